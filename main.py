@@ -1,9 +1,9 @@
 import sys
+import argparse
+import asyncio
 import logging
-import os
 from pathlib import Path
 from urllib.parse import urljoin, urlparse
-from tqdm import tqdm
 
 # 导入配置和RSS管理器
 from config.config import domainlist
@@ -46,58 +46,77 @@ def extract_keyword_from_url(url: str) -> str:
         return keyword
     return ""
 
-def process_domain(domain: str, session) -> tuple[bool, list[str], list[str]]:
+def get_sitemap_url(domain: str) -> str:
+    """如果domain不是直接的sitemap URL，则拼接sitemap.xml"""
+    return domain if domain.endswith('.xml') else urljoin(domain, 'sitemap.xml')
+
+# 关键词采集在快照变化记录中的读取位置名，和定时推送的进度互不影响
+KEYWORD_CONSUMER = "keywords"
+
+def process_domain(domain: str, session, feed_result: tuple | None = None, rss_manager: RSSManager | None = None) -> tuple[bool, list[str], list[str]]:
     """
     处理单个域名的sitemap，检查更新并返回新增链接和关键词
     
+    新增和更新过的链接来自上次运行之后快照记录的所有变化，
+    所以定时推送在这之间下载过的sitemap，其中的变化也不会漏掉。
+    
     Args:
         domain: 域名或直接的sitemap URL
         session: 当前会话对象
+        feed_result: 已经并发下载好的add_feed结果，为None时在这里同步下载
+        rss_manager: 使用的RSSManager，默认新建一个
         
     Returns:
         tuple[bool, list[str], list[str]]: (是否成功, 新增的URL列表, 提取的关键词列表)
     """
-    rss_manager = RSSManager()
-    
-    # 如果domain不是直接的sitemap URL，则拼接sitemap.xml
-    sitemap_url = domain if domain.endswith('.xml') else urljoin(domain, 'sitemap.xml')
+    sitemap_url = get_sitemap_url(domain)
     logging.info(f"处理域名: {domain}, sitemap URL: {sitemap_url}")
+    rss_manager = rss_manager or RSSManager()
     
     # 下载并比较sitemap
-    success, error_msg, file_path, new_urls = rss_manager.add_feed(sitemap_url)
+    if feed_result is None:
+        feed_result = rss_manager.add_feed(sitemap_url)
+    success, error_msg, _, _ = feed_result
     
-    if not success:
+    # 今天已经下载过（如定时推送）时下载结果不是成功，但变化已经记录下来了
+    changes, offset = rss_manager.unread_changes(sitemap_url, KEYWORD_CONSUMER)
+    if not success and not changes:
         logging.error(f"处理域名 {domain} 失败: {error_msg}")
         return False, [], []
+    new_urls, modified_urls = changes.added, changes.modified
     
-    # 提取关键词
-    word_list = [extract_keyword_from_url(url) for url in new_urls]
+    # 提取关键词，lastmod有变化的已有页面也重新采集
+    word_list = [extract_keyword_from_url(url) for url in new_urls + modified_urls]
     
-    # 保存关键词到RS表
-    for word in word_list:
-        if word and RS.validate(word) and not RS.exists(word, session.uuid):
-            rs = RS.create(
-                rs=word,
-                rk=f"game-{word}",
-                session_uuid=session.uuid
-            )
-            RS.conn.session.add(rs)
-    
-    # 提交事务
-    RS.conn.session.commit()
+    # 批量保存关键词到RS表，保存成功后才确认读取位置
+    RS.bulk_upsert(word_list, "game", session.uuid)
+    rss_manager.ack_changes(sitemap_url, KEYWORD_CONSUMER, offset)
     
     logging.info(f"域名 {domain} 处理成功")
     if new_urls:
         logging.info(f"发现 {len(new_urls)} 个新链接")
-    else:
+    if modified_urls:
+        logging.info(f"发现 {len(modified_urls)} 个更新过的链接")
+    if not new_urls and not modified_urls:
         logging.info("没有发现新链接")
     
     return True, new_urls, word_list
 
-def main():
+def main(resume: str | None = None):
     """
     主函数，处理配置中的所有域名
+    
+    Args:
+        resume: 中断的会话uuid，指定时跳过sitemap处理，只继续采集该会话未完成的multiline
     """
+    if resume:
+        sess = Session.find_one_by(uuid=resume)
+        if sess is None:
+            raise ValueError(f"会话 {resume} 不存在")
+        logging.info(f"继续会话: {sess.uuid}")
+        collect_session_multilines(sess)
+        return {}
+
     # 创建会话
     sess = Session.create(
         geo="",
@@ -106,11 +125,18 @@ def main():
     
     results = {}
     
-    for domain in domainlist:
-        if not domain:
-            continue
-            
-        success, new_urls, word_list = process_domain(domain, sess)
+    # 并发下载所有sitemap，耗时取决于最慢的那个而不是所有sitemap之和
+    domains = [domain for domain in domainlist if domain]
+    rss_manager = RSSManager()
+    feed_results = asyncio.run(
+        rss_manager.add_feeds([get_sitemap_url(domain) for domain in domains])
+    )
+    
+    logging.info(f"sitemap下载统计: {rss_manager.http.stats.to_dict()}")
+    
+    for domain in domains:
+        feed_result = feed_results[get_sitemap_url(domain)]
+        success, new_urls, word_list = process_domain(domain, sess, feed_result, rss_manager)
         results[domain] = {
             "success": success,
             "new_urls": new_urls,
@@ -135,12 +161,20 @@ def main():
             for word in result["word_list"]:
                 print(f"  - {word}")
             print("")
-    rss = RS.conn.session.query(RS).filter(RS.session_uuid==sess.uuid).all()
-
-    for rs in tqdm(rss, total=len(rss), desc='Collecting Multiline'):
-        collect_multiline(rs, sess=sess)
+    collect_session_multilines(sess)
     
     return results
 
+def collect_session_multilines(sess) -> None:
+    """采集会话下所有RS的multiline，进度记录在checkpoint中，中断后可以用--resume继续"""
+    checkpoint = Checkpoint(sess.uuid)
+    rss = RS.conn.session.query(RS).filter(RS.session_uuid==sess.uuid).all()
+    collect_multilines(rss, sess=sess, checkpoint=checkpoint)
+    SessionSeries.query(sess.uuid).save()
+    logging.info(f"checkpoint {checkpoint.path}: {checkpoint.summary('rs')}")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", metavar="SESSION_UUID", help="继续中断的会话")
+    args = parser.parse_args()
+    main(resume=args.resume)
\ No newline at end of file
@@ -1,7 +1,10 @@
-import logging
 import asyncio
+import logging
+from functools import partial
+from .delivery import TelegramSender, get_sender, pack_lines
 from .manager import RSSManager
-from pathlib import Path
+from .outbox import Outbox
+from .snapshots import Snapshot
 from urllib.parse import urlparse
 from core.config import telegram_config
 from telegram import Update, Bot
@@ -14,7 +17,7 @@ async def send_update_notification(
     bot: Bot,
     url: str,
     new_urls: list[str],
-    dated_file: Path | None,
+    snapshot: Snapshot | None,
     target_chat: str = None,
 ) -> None:
     """
@@ -25,11 +28,25 @@ async def send_update_notification(
         logging.error("未配置发送目标，请检查TELEGRAM_TARGET_CHAT环境变量")
         return
 
+    await deliver_update(get_sender(bot), chat_id, url, new_urls, snapshot)
+
+
+async def deliver_update(
+    sender: TelegramSender,
+    chat_id: str,
+    url: str,
+    new_urls: list[str],
+    snapshot: Snapshot | None,
+) -> None:
+    """
+    按顺序发送一个feed的通知：标题（或sitemap文件）、新增URL、结束消息。
+    """
     domain = urlparse(url).netloc
 
     try:
-        if dated_file and dated_file.exists():
+        if snapshot is not None and not snapshot.sent:
             # 根据是否有新增URL，分别构造美化后的标题
+            diff = snapshot.diff
             if new_urls:
                 header_message = (
                     f"✨ {domain} ✨\n"
@@ -37,6 +54,15 @@ async def send_update_notification(
                     f"发现新增内容！ (共 {len(new_urls)} 条)\n"
                     f"来源: {url}\n"
                 )
+            elif diff:
+                # 没有新增URL，但有页面被删除或者lastmod更新
+                header_message = (
+                    f"🔄 {domain}\n"
+                    f"------------------------------------\n"
+                    f"sitemap有变化: 删除 {len(diff.removed)} 条，更新 {len(diff.modified)} 条\n"
+                    f"来源: {url}\n"
+                    f"------------------------------------"
+                )
             else:
                 header_message = (
                     f"✅ {domain}\n"
@@ -45,23 +71,21 @@ async def send_update_notification(
                     f"来源: {url}\n"
                     f"------------------------------------"
                 )
-            await bot.send_document(
-                chat_id=chat_id,
-                document=dated_file,
-                caption=header_message,
-            )
-            logging.info(f"已发送sitemap文件: {dated_file} for {url}")
-            try:
-                dated_file.unlink()  # 发送成功后删除
-                logging.info(f"已删除临时sitemap文件: {dated_file}")
-            except OSError as e:
-                logging.error(f"删除文件失败: {dated_file}, Error: {str(e)}")
+            # 从快照临时解压出sitemap文件，发送后自动删除
+            async with snapshot.materialize_async() as sitemap_file:
+                await sender.send_document(
+                    chat_id,
+                    sitemap_file,
+                    caption=header_message,
+                )
+            snapshot.mark_sent()
+            logging.info(f"已发送sitemap文件: {snapshot.filename} for {url}")
         else:
             # 没有文件时，发送美化标题文本
             if not new_urls:
                 message = f"✅ {domain} 今日没有更新"
-                await bot.send_message(
-                    chat_id=chat_id, text=message, disable_web_page_preview=True
+                await sender.send_message(
+                    chat_id, message, disable_web_page_preview=True
                 )
             else:
                 header_message = (
@@ -70,28 +94,28 @@ async def send_update_notification(
                     f"发现新增内容！ (共 {len(new_urls)} 条)\n"
                     f"来源: {url}\n"
                 )
-                await bot.send_message(
-                    chat_id=chat_id, text=header_message, disable_web_page_preview=True
+                await sender.send_message(
+                    chat_id, header_message, disable_web_page_preview=True
                 )
 
-        await asyncio.sleep(1)
         if new_urls:
+            # 新增URL打包成尽量少的消息，太多时作为一个文本文件发送
             logging.info(f"开始发送 {len(new_urls)} 个新URL for {domain}")
-            for u in new_urls:
-                await bot.send_message(
-                    chat_id=chat_id, text=u, disable_web_page_preview=False
-                )
-                logging.info(f"已发送URL: {u}")
-                await asyncio.sleep(1)
-            logging.info(f"已发送 {len(new_urls)} 个新URL for {domain}")
+            sent = await sender.send_lines(
+                chat_id,
+                new_urls,
+                document_name=f"{domain}-new-urls.txt",
+                caption=f"{domain} 新增URL (共 {len(new_urls)} 条)",
+                disable_web_page_preview=False,
+            )
+            logging.info(f"已发送 {len(new_urls)} 个新URL for {domain}，共 {sent} 条消息")
 
             # 发送更新结束的消息
-            await asyncio.sleep(1)
             end_message = (
                 f"✨ {domain} 更新推送完成 ✨\n------------------------------------"
             )
-            await bot.send_message(
-                chat_id=chat_id, text=end_message, disable_web_page_preview=True
+            await sender.send_message(
+                chat_id, end_message, disable_web_page_preview=True
             )
             logging.info(f"已发送更新结束消息 for {domain}")
     except Exception as e:
@@ -99,6 +123,71 @@ async def send_update_notification(
         # logging.traceback.print_exc()
 
 
+def bots_from_tokens(tokens: str) -> list[Bot]:
+    """根据逗号分隔的TELEGRAM_TOKEN创建bot列表"""
+    return [Bot(token.strip()) for token in tokens.split(",") if token.strip()]
+
+
+async def notify_feeds(
+    bots: list[Bot],
+    urls: list[str] | None = None,
+    target_chat: str = None,
+    check_today: bool = True,
+    only_updates: bool = False,
+) -> dict:
+    """
+    检查所有feed并推送更新通知
+
+    所有sitemap并发下载，各feed的通知并发提交到发件箱，
+    由发件箱保证每个chat内的消息顺序，最后发送关键词汇总。
+
+    Args:
+        bots: 用于发送的bot，多个bot共同分担发送
+        urls: 要检查的sitemap，默认是所有已订阅的feed
+        target_chat: 发送目标ID,默认使用配置中的target_chat
+        check_today: 为False时不受每天只下载一次的限制
+        only_updates: 为True时只推送有变化（新增、删除或lastmod更新）的feed，
+            没有新增URL时不发送关键词汇总
+
+    Returns:
+        dict: url -> add_feed的结果
+    """
+    chat_id = target_chat or telegram_config["target_chat"]
+    if not chat_id:
+        logging.error("未配置发送目标，请检查TELEGRAM_TARGET_CHAT环境变量")
+        return {}
+
+    urls = urls if urls is not None else rss_manager.get_feeds()
+    results = await rss_manager.add_feeds(urls, check_today=check_today)
+
+    all_new_urls = []
+    async with Outbox(bots) as outbox:
+        pending = []
+        for url, (success, error_msg, snapshot, new_urls) in results.items():
+            if not success:
+                logging.warning(f"检查feed失败: {url}, 原因: {error_msg}")
+                continue
+            if only_updates and not new_urls and not (snapshot and snapshot.diff):
+                continue
+            all_new_urls.extend(new_urls)
+            notification = partial(
+                deliver_update,
+                chat_id=chat_id,
+                url=url,
+                new_urls=new_urls,
+                snapshot=snapshot,
+            )
+            pending.append(outbox.submit(chat_id, notification))
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    if all_new_urls or not only_updates:
+        await send_keywords_summary(bots[0], all_new_urls, chat_id)
+    logging.info(
+        f"已推送 {len(pending)} 个feed的更新，新增URL共 {len(all_new_urls)} 条"
+    )
+    return results
+
+
 async def rss_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """处理 /rss 命令"""
     user = update.message.from_user
@@ -144,7 +233,7 @@ async def rss_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             return
 
         logging.info(f"执行add命令，URL: {url}")
-        success, error_msg, dated_file, new_urls = rss_manager.add_feed(url)
+        success, error_msg, snapshot, new_urls = rss_manager.add_feed(url)
 
         if success:
             if "已存在的feed更新成功" in error_msg:
@@ -153,32 +242,30 @@ async def rss_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
                 await update.message.reply_text(f"成功添加sitemap监控：{url}")
 
             # 调用新的合并函数
-            await send_update_notification(context.bot, url, new_urls, dated_file)
+            await send_update_notification(context.bot, url, new_urls, snapshot)
             logging.info(f"已尝试发送更新通知 for {url} after add command")
 
         else:
             if "今天已经更新过此sitemap" in error_msg:
                 # 获取当前文件并发送给用户 (这部分是发送给命令发起者的，逻辑保持)
                 try:
-                    domain = urlparse(url).netloc
-                    current_file = (
-                        rss_manager.sitemap_dir / domain / "sitemap-current.xml"
-                    )
-                    if current_file.exists():
-                        await context.bot.send_document(
-                            chat_id=update.effective_chat.id,  # 发送给命令发起者
-                            document=current_file,
-                            caption=f"今天的Sitemap文件\nURL: {url}",
-                        )
+                    latest = rss_manager.snapshots(url).latest()
+                    if latest is not None:
+                        async with latest.materialize_async() as sitemap_file:
+                            await context.bot.send_document(
+                                chat_id=update.effective_chat.id,  # 发送给命令发起者
+                                document=sitemap_file,
+                                caption=f"今天的Sitemap文件\nURL: {url}",
+                            )
                         await update.message.reply_text(f"该sitemap今天已经更新过")
                         # 即使今天更新过，也尝试给频道发送一次通知（可能包含上次比较的结果）
-                        # 注意：这里 dated_file 可能不存在，需要处理
-                        _, _, dated_file_maybe, existing_new_urls = (
+                        # 注意：这里只有还没发送过的快照才会返回
+                        _, _, snapshot_maybe, existing_new_urls = (
                             rss_manager.download_sitemap(url)
-                        )  # 再次调用以获取文件和URL
-                        if dated_file_maybe:
+                        )  # 再次调用以获取快照和URL
+                        if snapshot_maybe:
                             await send_update_notification(
-                                context.bot, url, existing_new_urls, dated_file_maybe
+                                context.bot, url, existing_new_urls, snapshot_maybe
                             )
 
                     else:
@@ -281,10 +368,12 @@ async def send_keywords_summary(
                     summary_message += f"  {i}. {keyword}\n"
                 summary_message += "\n"  # 域名之间添加空行分隔
 
-        # 发送汇总消息
+        # 发送汇总消息，超过长度限制时按行拆成多条
         try:
-            await bot.send_message(
-                chat_id=chat_id, text=summary_message, disable_web_page_preview=True
-            )
+            sender = get_sender(bot)
+            for message in pack_lines(summary_message.rstrip("\n").split("\n")):
+                await sender.send_message(
+                    chat_id, message, disable_web_page_preview=True
+                )
         except Exception as e:
             logging.error(f"发送关键词汇总消息失败 (chat_id: {chat_id}): {str(e)}")
@@ -0,0 +1,164 @@
+import asyncio
+import io
+import logging
+import time
+from datetime import timedelta
+
+from telegram import Bot
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+# Telegram单条消息的最大长度
+MESSAGE_LIMIT = 4096
+
+
+def pack_lines(lines: list[str], limit: int = MESSAGE_LIMIT) -> list[str]:
+    """把多行文本按顺序装进尽量少的消息，每条不超过limit个字符
+
+    超过limit的单行会被截成多段。
+    """
+    messages = []
+    current = ""
+    for line in lines:
+        while len(line) > limit:
+            if current:
+                messages.append(current)
+                current = ""
+            messages.append(line[:limit])
+            line = line[limit:]
+        if not current:
+            current = line
+        elif len(current) + 1 + len(line) <= limit:
+            current = f"{current}\n{line}"
+        else:
+            messages.append(current)
+            current = line
+    if current:
+        messages.append(current)
+    return messages
+
+
+class AsyncTokenBucket:
+    """协程版的令牌桶，每秒补充rate个令牌，最多积累capacity个"""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TelegramSender:
+    """按Telegram的限流规则发送消息
+
+    每个chat一个令牌桶（默认每秒1条，可以突发3条），所有chat再共用一个
+    全局令牌桶（默认每秒25条）。收到RetryAfter时按服务端给的时间等待后重试，
+    网络错误按指数退避重试。
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        per_chat_rate: float = 1.0,
+        per_chat_burst: int = 3,
+        global_rate: float = 25.0,
+        max_retries: int = 5,
+    ):
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self._global = AsyncTokenBucket(global_rate, int(global_rate))
+        self._chats: dict[str, AsyncTokenBucket] = {}
+        self.stats = {"requests": 0, "retry_after": 0, "network_retries": 0}
+
+    def _bucket(self, chat_id) -> AsyncTokenBucket:
+        key = str(chat_id)
+        if key not in self._chats:
+            self._chats[key] = AsyncTokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return self._chats[key]
+
+    async def _call(self, chat_id, method, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            await self._bucket(chat_id).acquire()
+            await self._global.acquire()
+            self.stats["requests"] += 1
+            try:
+                return await method(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = _retry_after_seconds(e)
+                self.stats["retry_after"] += 1
+                logging.warning(f"Telegram限流，{delay:.0f}秒后重试 (chat_id: {chat_id})")
+                await asyncio.sleep(delay)
+            except BadRequest:
+                # BadRequest是NetworkError的子类，但chat不存在、消息太长这类错误重试也没用
+                raise
+            except (TimedOut, NetworkError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = min(2**attempt, 30)
+                self.stats["network_retries"] += 1
+                logging.warning(f"发送Telegram消息失败: {e}，{delay}秒后重试")
+                await asyncio.sleep(delay)
+
+    async def send_message(self, chat_id, text: str, **kwargs):
+        return await self._call(chat_id, self.bot.send_message, text=text, **kwargs)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        return await self._call(chat_id, self.bot.send_document, document=document, **kwargs)
+
+    async def send_lines(
+        self,
+        chat_id,
+        lines: list[str],
+        document_name: str,
+        max_messages: int = 5,
+        caption: str | None = None,
+        **kwargs,
+    ) -> int:
+        """把多行文本打包发送，返回发送的消息数
+
+        打包后不超过max_messages条时逐条发送，否则整体作为一个文本文件发送。
+        """
+        messages = pack_lines(lines)
+        if len(messages) <= max_messages:
+            for message in messages:
+                await self.send_message(chat_id, message, **kwargs)
+            return len(messages)
+        document = io.BytesIO("\n".join(lines).encode())
+        await self.send_document(
+            chat_id, document, filename=document_name, caption=caption
+        )
+        return 1
+
+
+# 每个bot一个发送器，同一个bot的所有通知共用限流状态
+_senders: dict[str, TelegramSender] = {}
+
+
+def get_sender(bot: Bot) -> TelegramSender:
+    if bot.token not in _senders:
+        _senders[bot.token] = TelegramSender(bot)
+    return _senders[bot.token]
@@ -0,0 +1,352 @@
+import asyncio
+import io
+import logging
+import time
+import weakref
+import zlib
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
+    "Accept-Encoding": "gzip, deflate, br" if brotli else "gzip, deflate",
+}
+CHUNK_SIZE = 64 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+@dataclass
+class FetchResult:
+    """单个sitemap的下载结果"""
+
+    url: str
+    status: int = 0
+    content: bytes = b""
+    path: Path | None = None
+    headers: dict = field(default_factory=dict)
+    error: str = ""
+    elapsed: float = 0.0
+    queued: float = 0.0  # 其中等待连接池空位的时间
+
+    @property
+    def ok(self) -> bool:
+        return not self.error
+
+    @property
+    def latency(self) -> float:
+        """服务器本身的耗时：不包括排队等待连接的时间"""
+        return max(0.0, self.elapsed - self.queued)
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+
+@dataclass
+class HttpStats:
+    """HTTP传输统计，同步和异步下载共用"""
+
+    requests: int = 0
+    new_connections: int = 0
+    reused_connections: int = 0
+    not_modified: int = 0
+    bytes_on_wire: int = 0  # 实际传输的（压缩后的）字节数
+    bytes_decoded: int = 0  # 解压后的字节数
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class BodyDecoder:
+    """流式解码响应体
+
+    先按Content-Encoding解压传输层压缩（gzip/deflate/br），
+    再识别.xml.gz这类本身就是gzip文件的sitemap并解压。
+    """
+
+    def __init__(self, content_encoding: str | None = None):
+        encoding = (content_encoding or "").lower().strip()
+        if encoding in ("gzip", "x-gzip", "deflate"):
+            # 32 + MAX_WBITS 自动识别gzip/zlib头
+            transport = zlib.decompressobj(32 + zlib.MAX_WBITS)
+            self._decompress, self._flush = transport.decompress, transport.flush
+        elif encoding == "br":
+            if brotli is None:
+                raise ValueError("响应使用br压缩，但没有安装brotli")
+            transport = brotli.Decompressor()
+            self._decompress, self._flush = transport.process, lambda: b""
+        else:
+            self._decompress, self._flush = lambda chunk: chunk, lambda: b""
+        self._file = None  # None: 还未判断; False: 不是gzip文件
+        self._head = b""
+
+    def _decode_file(self, data: bytes, final: bool = False) -> bytes:
+        if self._file is None:
+            # 凑够魔数的长度再判断是否为gzip文件
+            self._head += data
+            if len(self._head) < len(GZIP_MAGIC) and not final:
+                return b""
+            data, self._head = self._head, b""
+            self._file = (
+                zlib.decompressobj(16 + zlib.MAX_WBITS)
+                if data.startswith(GZIP_MAGIC)
+                else False
+            )
+        if not self._file:
+            return data
+        out = self._file.decompress(data)
+        return out + self._file.flush() if final else out
+
+    def feed(self, chunk: bytes) -> bytes:
+        return self._decode_file(self._decompress(chunk))
+
+    def flush(self) -> bytes:
+        return self._decode_file(self._flush(), final=True)
+
+
+class _BodyWriter:
+    """把原始响应体解码后写入文件或内存，同时统计字节数"""
+
+    def __init__(self, stats: HttpStats, content_encoding: str | None, dest: Path | None):
+        self.stats = stats
+        self.decoder = BodyDecoder(content_encoding)
+        self.dest = dest
+        self._out = open(dest, "wb") if dest is not None else io.BytesIO()
+
+    def write(self, chunk: bytes) -> None:
+        self.stats.bytes_on_wire += len(chunk)
+        self._emit(self.decoder.feed(chunk))
+
+    def _emit(self, data: bytes) -> None:
+        if data:
+            self.stats.bytes_decoded += len(data)
+            self._out.write(data)
+
+    def close(self) -> bytes:
+        """结束写入，写入内存时返回解码后的内容"""
+        try:
+            self._emit(self.decoder.flush())
+            return b"" if self.dest is not None else self._out.getvalue()
+        finally:
+            self._out.close()
+
+
+class HttpClient:
+    """带连接池的同步HTTP客户端
+
+    同一个host的多个sitemap分片复用keep-alive连接，
+    响应体自行解压，从而能够统计实际传输的字节数。
+    """
+
+    def __init__(self, pool_connections: int = 16, pool_maxsize: int = 4):
+        self.stats = HttpStats()
+        self._session = requests.Session()
+        self._session.headers.update(DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._connections = weakref.WeakSet()
+
+    def close(self) -> None:
+        self._session.close()
+
+    def _count_connection(self, response: requests.Response) -> None:
+        connection = getattr(response.raw, "connection", None)
+        if connection is None:
+            return
+        if connection in self._connections:
+            self.stats.reused_connections += 1
+        else:
+            self._connections.add(connection)
+            self.stats.new_connections += 1
+
+    def fetch(
+        self,
+        url: str,
+        headers: dict | None = None,
+        timeout: float = 10,
+        dest: Path | None = None,
+    ) -> FetchResult:
+        """下载url，HTTP错误会以requests异常的形式抛出
+
+        Args:
+            url: 请求的URL
+            headers: 额外的请求头
+            timeout: 超时时间（秒）
+            dest: 指定时把解码后的响应体流式写入该文件，而不是读到内存中
+        """
+        start = time.monotonic()
+        with self._session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+            self.stats.requests += 1
+            self._count_connection(response)
+            response.raise_for_status()
+            if response.status_code == 304:
+                # 条件请求命中，没有响应体
+                self.stats.not_modified += 1
+                return FetchResult(
+                    url=url,
+                    status=304,
+                    headers=response.headers,
+                    elapsed=time.monotonic() - start,
+                )
+            writer = _BodyWriter(self.stats, response.headers.get("Content-Encoding"), dest)
+            try:
+                while chunk := response.raw.read(CHUNK_SIZE, decode_content=False):
+                    writer.write(chunk)
+            finally:
+                content = writer.close()
+            return FetchResult(
+                url=url,
+                status=response.status_code,
+                content=content,
+                path=dest,
+                headers=response.headers,
+                elapsed=time.monotonic() - start,
+            )
+
+
+class SitemapFetcher:
+    """基于aiohttp的并发sitemap下载器
+
+    通过连接器限制总连接数和单个host的连接数，
+    避免某个慢速站点拖住整个批次。
+    timeout只限制建立连接和两次读取之间的等待，不包括排队等待连接池空位的时间，
+    同一host的多个分片排队下载时不会因为排在后面而超时。
+    """
+
+    def __init__(
+        self,
+        limit: int = 16,
+        limit_per_host: int = 4,
+        timeout: float = 10,
+        stats: HttpStats | None = None,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=timeout, sock_read=timeout
+        )
+        self.stats = stats or HttpStats()
+        self._session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self) -> "SitemapFetcher":
+        connector = aiohttp.TCPConnector(
+            limit=self.limit, limit_per_host=self.limit_per_host
+        )
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+        trace_config.on_connection_queued_start.append(self._on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(self._on_connection_queued_end)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            headers=DEFAULT_HEADERS,
+            auto_decompress=False,  # 自行解压，才能统计传输的字节数
+            trace_configs=[trace_config],
+        )
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _on_connection_create(self, session, context, params) -> None:
+        self.stats.new_connections += 1
+
+    async def _on_connection_reuse(self, session, context, params) -> None:
+        self.stats.reused_connections += 1
+
+    async def _on_connection_queued_start(self, session, context, params) -> None:
+        context.queued_at = time.monotonic()
+
+    async def _on_connection_queued_end(self, session, context, params) -> None:
+        # trace_request_ctx是fetch传入的字典，用来把排队时间带回结果
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx["queued"] += time.monotonic() - context.queued_at
+
+    async def fetch(
+        self, url: str, headers: dict | None = None, dest: Path | None = None
+    ) -> FetchResult:
+        """下载单个sitemap，异常不会抛出，而是记录在结果的error字段中
+
+        Args:
+            url: sitemap的URL
+            headers: 额外的请求头
+            dest: 指定时把解码后的响应体流式写入该文件，而不是读到内存中
+        """
+        if self._session is None:
+            raise RuntimeError("SitemapFetcher未初始化，请使用 async with")
+
+        start = time.monotonic()
+        trace = {"queued": 0.0}
+        try:
+            async with self._session.get(
+                url, headers=headers, trace_request_ctx=trace
+            ) as response:
+                self.stats.requests += 1
+                response.raise_for_status()
+                if response.status == 304:
+                    # 条件请求命中，没有响应体
+                    self.stats.not_modified += 1
+                    return FetchResult(
+                        url=url,
+                        status=304,
+                        headers=dict(response.headers),
+                        elapsed=time.monotonic() - start,
+                        queued=trace["queued"],
+                    )
+                writer = _BodyWriter(
+                    self.stats, response.headers.get("Content-Encoding"), dest
+                )
+                try:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        writer.write(chunk)
+                finally:
+                    content = writer.close()
+                return FetchResult(
+                    url=url,
+                    status=response.status,
+                    content=content,
+                    path=dest,
+                    headers=dict(response.headers),
+                    elapsed=time.monotonic() - start,
+                    queued=trace["queued"],
+                )
+        except asyncio.TimeoutError:
+            error = f"请求超时 ({self.timeout.sock_read}s)"
+        except (aiohttp.ClientError, zlib.error, ValueError) as e:
+            error = str(e)
+        logging.error(f"下载sitemap失败: {url}, 错误: {error}")
+        return FetchResult(
+            url=url, error=error, elapsed=time.monotonic() - start, queued=trace["queued"]
+        )
+
+    async def fetch_many(
+        self,
+        urls: list[str],
+        dests: list[Path] | None = None,
+        headers: list[dict] | None = None,
+    ) -> list[FetchResult]:
+        """并发下载多个sitemap，结果顺序与urls一致"""
+        dests = dests or [None] * len(urls)
+        headers = headers or [None] * len(urls)
+        return await asyncio.gather(
+            *(
+                self.fetch(url, headers=h, dest=dest)
+                for url, dest, h in zip(urls, dests, headers)
+            )
+        )
@@ -0,0 +1,133 @@
+import sqlite3
+from pathlib import Path
+from typing import Iterable
+
+from .parser import SitemapDiff, lastmod_key, url_key
+
+
+class UrlIndex:
+    """单个feed已知URL的持久化索引
+
+    保存在feed目录下的SQLite文件中，以URL的64位哈希为主键，
+    新增URL的判断只是一次主键查找，不需要再解析昨天的sitemap。
+    每个URL同时保存<lastmod>的64位哈希，判断页面是否更新只比较哈希。
+    last_seen记录URL最后一次出现在第几次合并中，上一次合并出现、这一次没有出现的
+    就是被删除的URL，同样不需要解析上一份sitemap。
+    """
+
+    FILENAME = "urls.db"
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS urls ("
+            " key INTEGER PRIMARY KEY,"
+            " url TEXT NOT NULL,"
+            " first_seen TEXT,"  # YYYYMMDD，初始化导入的URL为NULL
+            " lastmod INTEGER,"  # <lastmod>的哈希，没有lastmod时为NULL
+            " last_seen INTEGER"  # 最后一次出现的合并序号，旧版本导入的URL为NULL
+            ")"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(urls)")}
+        # 旧版本的索引没有lastmod和last_seen列
+        for column in ("lastmod", "last_seen"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE urls ADD COLUMN {column} INTEGER")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_urls_first_seen ON urls (first_seen)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_urls_last_seen ON urls (last_seen)"
+        )
+
+    def __enter__(self) -> "UrlIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+    def last_run(self) -> int | None:
+        """最近一次合并的序号，还没有合并过时为None"""
+        return self._conn.execute("SELECT MAX(last_seen) FROM urls").fetchone()[0]
+
+    def seed(self, entries: Iterable[tuple[str, str | None]]) -> int:
+        """导入已有的(URL, lastmod)（不算作新增），作为一次合并，返回导入的数量"""
+        run = (self.last_run() or 0) + 1
+        with self._conn:
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO urls (key, url, first_seen, lastmod, last_seen)"
+                " VALUES (?, ?, NULL, ?, ?)",
+                (
+                    (url_key(url), url, lastmod_key(lastmod), run)
+                    for url, lastmod in entries
+                ),
+            )
+        return cursor.rowcount
+
+    def merge(
+        self, entries: Iterable[tuple[str, str | None]], first_seen: str
+    ) -> tuple[list[str], SitemapDiff]:
+        """把(URL, lastmod)合并进索引，返回(第一次出现的URL, 相对上一次合并的变化)
+
+        上一次合并中没有出现的URL算作added，上一次出现、这一次没有出现的算作removed；
+        lastmod是否变化只和索引中保存的哈希比较，在同一次遍历中完成：
+        之前没有记录lastmod的只补上哈希，重新出现的URL只算作added，都不算作modified。
+        旧版本的索引还没有last_seen时，这一次不判断删除和重新出现的URL。
+        整个过程在一个事务中完成。
+        """
+        previous = self.last_run()
+        run = (previous or 0) + 1
+        new_urls = []
+        diff = SitemapDiff()
+        with self._conn:
+            for url, lastmod in entries:
+                key = url_key(url)
+                lastmod = lastmod_key(lastmod)
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO urls (key, url, first_seen, lastmod, last_seen)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, url, first_seen, lastmod, run),
+                )
+                if cursor.rowcount:
+                    new_urls.append(url)
+                    diff.added.append(url)
+                    continue
+                stored, last_seen = self._conn.execute(
+                    "SELECT lastmod, last_seen FROM urls WHERE key = ?", (key,)
+                ).fetchone()
+                if last_seen == run:
+                    # 同一个sitemap里重复出现的URL
+                    continue
+                reappeared = previous is not None and last_seen != previous
+                if reappeared:
+                    diff.added.append(url)
+                changed = lastmod is not None and stored != lastmod
+                # last_seen和lastmod在同一条UPDATE中更新
+                self._conn.execute(
+                    "UPDATE urls SET last_seen = ?, lastmod = ? WHERE key = ?",
+                    (run, lastmod if changed else stored, key),
+                )
+                if changed and stored is not None and not reappeared:
+                    diff.modified.append(url)
+            if previous is not None:
+                diff.removed = [
+                    row[0]
+                    for row in self._conn.execute(
+                        "SELECT url FROM urls WHERE last_seen = ?", (previous,)
+                    )
+                ]
+        return new_urls, diff
+
+    def added_on(self, date: str) -> list[str]:
+        """获取某一天新增的URL"""
+        rows = self._conn.execute(
+            "SELECT url FROM urls WHERE first_seen = ?", (date,)
+        )
+        return [row[0] for row in rows]
@@ -1,139 +1,469 @@
+import asyncio
+import io
 import json
 import logging
 from pathlib import Path
 from datetime import datetime
 from urllib.parse import urlparse
+from xml.etree import ElementTree as ET
 import requests
 
+from .fetcher import FetchResult, HttpClient, SitemapFetcher
+from .index import UrlIndex
+from .parser import SitemapDiff, diff_locs, split_sitemap, url_key
+from .snapshots import Snapshot, SnapshotStore
+from .validators import ValidatorCache
+
+NOT_MODIFIED_MSG = "sitemap未变化"
+
+
+class SitemapCrawlError(Exception):
+    """展开sitemap索引时有子sitemap下载或解析失败，得到的URL集合不完整"""
+
+    def __init__(self, sitemap_url: str, failed: list[str]):
+        super().__init__(
+            f"{sitemap_url} 有 {len(failed)} 个sitemap获取失败: {', '.join(failed[:5])}"
+            + (" ..." if len(failed) > 5 else "")
+        )
+        self.sitemap_url = sitemap_url
+        self.failed = failed
+
 
 class RSSManager:
-    def __init__(self):
+    def __init__(self, http: HttpClient | None = None):
+        # 所有同步请求共用一个带连接池的客户端，异步下载也记录到同一份统计中
+        self.http = http or HttpClient()
         self.config_dir = Path("storage/rss/config")
         self.sitemap_dir = Path("storage/rss/sitemaps")  # 存储sitemap的基础目录
+        self.download_dir = self.sitemap_dir / ".downloads"  # 下载中的临时文件
         self.feeds_file = self.config_dir / "feeds.json"
+        self.latency: dict[str, float] = {}  # URL -> 最近一次下载耗时（秒，不含排队等待连接）
         self._init_directories()
 
     def _init_directories(self):
         """初始化必要的目录"""
         self.config_dir.mkdir(parents=True, exist_ok=True)
         self.sitemap_dir.mkdir(parents=True, exist_ok=True)
+        self.download_dir.mkdir(parents=True, exist_ok=True)
 
         if not self.feeds_file.exists():
             self.feeds_file.write_text("[]")
 
-    def download_sitemap(self, url: str) -> tuple[bool, str, Path | None, list[str]]:
-        """下载并保存sitemap文件
+    def feed_dir(self, url: str) -> Path:
+        """获取feed的存储目录
+
+        同一域名下可能有多个sitemap分片（如kbhgames的post-sitemapN.xml），
+        因此按 域名/路径 区分，避免分片之间互相覆盖。
+        """
+        parsed = urlparse(url)
+        name = parsed.path.strip("/").replace("/", "_")
+        for suffix in (".xml.gz", ".xml"):
+            if name.endswith(suffix):
+                name = name[: -len(suffix)]
+                break
+        return self.sitemap_dir / parsed.netloc / (name or "root")
+
+    def _migrate_domain_layout(self, url: str) -> None:
+        """把旧版本按域名保存的sitemap文件移到feed自己的目录
+
+        旧版本所有文件都在 sitemaps/<域名>/ 下。域名下只有一个feed，
+        或者这是默认的sitemap.xml时，文件属于这个feed，直接移动；
+        同一域名的多个分片以前共用同一组文件，内容无法区分，不迁移，
+        等每个分片都有了自己的快照存档之后，把旧文件移到 <域名>/.legacy/ 下。
+        """
+        parsed = urlparse(url)
+        domain_root = self.sitemap_dir / parsed.netloc
+        if not (domain_root / "sitemap-current.xml").exists():
+            return
+        legacy_files = [
+            domain_root / "sitemap-current.xml",
+            domain_root / "sitemap-latest.xml",
+            domain_root / "last_update.txt",
+            *domain_root.glob(f"{parsed.netloc}_sitemap_*.xml"),
+        ]
+        siblings = {
+            feed for feed in self.get_feeds() if urlparse(feed).netloc == parsed.netloc
+        }
+        if parsed.path.strip("/") not in ("", "sitemap.xml") and not siblings <= {url}:
+            if all(
+                (self.feed_dir(feed) / SnapshotStore.MANIFEST).exists() for feed in siblings
+            ):
+                self._move_files(legacy_files, domain_root / ".legacy")
+                logging.info(f"{parsed.netloc} 的分片都已有快照存档，旧的sitemap文件移到了 .legacy")
+            else:
+                logging.warning(f"{parsed.netloc} 有多个feed，旧的sitemap文件无法对应，不迁移")
+            return
+        domain_dir = self.feed_dir(url)
+        self._move_files(legacy_files, domain_dir)
+        logging.info(f"已把旧的sitemap文件移到: {domain_dir}")
+
+    @staticmethod
+    def _move_files(files: list[Path], target_dir: Path) -> None:
+        target_dir.mkdir(parents=True, exist_ok=True)
+        for file in files:
+            if file.exists():
+                file.replace(target_dir / file.name)
+
+    def snapshots(self, url: str) -> SnapshotStore:
+        """获取feed的快照存档
+
+        旧版本留下的sitemap-current.xml会被导入为已发送的快照，
+        还没有发送的带日期文件导入为对应日期未发送的快照。
+        """
+        self._migrate_domain_layout(url)
+        domain = urlparse(url).netloc
+        domain_dir = self.feed_dir(url)
+        store = SnapshotStore(domain_dir, domain)
+        legacy_file = domain_dir / "sitemap-current.xml"
+        if not legacy_file.exists():
+            return store
+        with store.lock():
+            self._import_legacy(store, legacy_file)
+        return store
+
+    def _import_legacy(self, store: SnapshotStore, legacy_file: Path) -> None:
+        """导入旧版本的sitemap文件，调用时持有feed目录的锁"""
+        domain, domain_dir = store.name, store.dir
+        if legacy_file.exists() and not store.manifest_file.exists():
+            for dated_file in sorted(domain_dir.glob(f"{domain}_sitemap_*.xml")):
+                date = dated_file.stem.rsplit("_", 1)[-1]
+                store.put(dated_file, date)
+                dated_file.unlink()
+            last_update_file = domain_dir / "last_update.txt"
+            date = (
+                last_update_file.read_text().strip()
+                if last_update_file.exists()
+                else datetime.now().strftime("%Y%m%d")
+            )
+            if store.get(date) is None:
+                store.put(legacy_file, date, sent=True)
+            logging.info(f"已把旧的sitemap导入快照存档: {legacy_file}")
+            legacy_file.unlink()
+            (domain_dir / "sitemap-latest.xml").unlink(missing_ok=True)
+
+    def _check_today(self, url: str) -> tuple[bool, str, Snapshot | None, list[str]] | None:
+        """检查今天是否已经更新过此sitemap
+
+        Returns:
+            已更新过时返回与download_sitemap相同格式的结果，否则返回None
+        """
+        store = self.snapshots(url)
+        domain_dir = self.feed_dir(url)
+
+        last_update_file = domain_dir / "last_update.txt"
+        today = datetime.now().strftime("%Y%m%d")
+        logging.info(f"今天的日期: {today}")
+
+        if not last_update_file.exists():
+            return None
+        last_date = last_update_file.read_text().strip()
+        logging.info(f"上次更新日期: {last_date}")
+        if last_date != today:
+            return None
+        snapshot = store.get(today)
+        if snapshot is not None and not snapshot.sent:
+            with UrlIndex(domain_dir / UrlIndex.FILENAME) as index:
+                new_urls = index.added_on(today)
+            snapshot.diff = store.diff_on(today)
+            return True, "今天已经更新过此sitemap, 但没发送", snapshot, new_urls
+        return False, "今天已经更新过此sitemap", None, []
+
+    def unread_changes(self, url: str, consumer: str) -> tuple[SitemapDiff, int]:
+        """feed在consumer上次确认之后的变化，返回(合并的变化, 确认用的位置)
+
+        变化来自快照存档的deltas.jsonl，和是谁下载的sitemap无关，
+        每个consumer各自记录读到的位置，互不影响。
+        """
+        store = SnapshotStore(self.feed_dir(url), urlparse(url).netloc)
+        return store.unread(consumer)
+
+    def ack_changes(self, url: str, consumer: str, offset: int) -> None:
+        """确认consumer已经处理完offset之前的变化"""
+        domain_dir = self.feed_dir(url)
+        if domain_dir.exists():
+            SnapshotStore(domain_dir, urlparse(url).netloc).set_cursor(consumer, offset)
+
+    def _download_file(self, url: str) -> Path:
+        """下载文件的临时保存路径，保存为快照后删除"""
+        return self.download_dir / f"{url_key(url) & 0xFFFFFFFFFFFFFFFF:016x}.tmp"
+
+    def _conditional_headers(self, url: str) -> dict:
+        """本地有上一次的sitemap时，构造If-None-Match/If-Modified-Since请求头
+
+        只检查文件是否存在，不创建目录，可以用于任意URL（如索引中的子sitemap）。
+        """
+        domain_dir = self.feed_dir(url)
+        if not (
+            (domain_dir / SnapshotStore.MANIFEST).exists()
+            or (domain_dir / "sitemap-current.xml").exists()
+        ):
+            return {}
+        return ValidatorCache(domain_dir).request_headers()
+
+    def _not_modified(self, url: str) -> tuple[bool, str, Snapshot | None, list[str]]:
+        """服务器返回304时，跳过保存、解析和比较，只记录今天已经检查过"""
+        today = datetime.now().strftime("%Y%m%d")
+        (self.feed_dir(url) / "last_update.txt").write_text(today)
+        logging.info(f"sitemap未变化(304): {url}")
+        return True, NOT_MODIFIED_MSG, None, []
+
+    def _save_sitemap(
+        self, url: str, downloaded: Path, response_headers=None
+    ) -> tuple[bool, str, Snapshot | None, list[str]]:
+        """把下载好的sitemap存为今天的快照并与上一份快照比较
 
         Args:
             url: sitemap的URL
+            downloaded: 已下载到本地的响应体文件，保存后删除
+            response_headers: 响应头，用于保存ETag/Last-Modified
 
         Returns:
-            tuple[bool, str, Path | None, list[str]]: (是否成功, 错误信息, 带日期的文件路径, 新增的URL列表)
+            tuple[bool, str, Snapshot | None, list[str]]: (是否成功, 错误信息, 当天的sitemap快照, 新增的URL列表)
         """
-        try:
-            # 获取域名作为目录名
-            logging.info(f"尝试下载sitemap: {url}")
-            domain = urlparse(url).netloc
-            domain_dir = self.sitemap_dir / domain
-            domain_dir.mkdir(parents=True, exist_ok=True)
+        domain_dir = self.feed_dir(url)
+        domain_dir.mkdir(parents=True, exist_ok=True)
+        store = self.snapshots(url)
+        # 定时推送和main.py可能同时保存同一个feed，快照、索引和变化记录要一起更新
+        with store.lock():
+            return self._save_snapshot(url, store, downloaded, response_headers)
+
+    def _save_snapshot(
+        self, url: str, store: SnapshotStore, downloaded: Path, response_headers
+    ) -> tuple[bool, str, Snapshot | None, list[str]]:
+        """_save_sitemap持有feed目录的锁之后的部分"""
+        domain_dir = store.dir
+        today = datetime.now().strftime("%Y%m%d")
+
+        previous = store.latest()
+        snapshot = store.put(downloaded, today)
+        downloaded.unlink(missing_ok=True)
+        if previous is not None and previous.digest == snapshot.digest:
+            # 内容和上一份快照相同，不需要再解析
+            logging.info(f"sitemap内容未变化: {url}")
+            snapshot.diff = SitemapDiff()
+            new_urls = []
+        else:
+            snapshot.diff, new_urls = self._update_index(
+                domain_dir, store, snapshot, previous
+            )
+
+        # 更新最后更新日期和缓存校验信息
+        (domain_dir / "last_update.txt").write_text(today)
+        ValidatorCache(domain_dir).store(response_headers or {})
+
+        logging.info(f"sitemap快照已保存: {store.blob_path(snapshot.digest)}")
+        return True, "", snapshot, new_urls  # 只添加新URLs返回
+
+    def _update_index(
+        self,
+        domain_dir: Path,
+        store: SnapshotStore,
+        snapshot: Snapshot,
+        previous: Snapshot | None,
+    ) -> tuple[SitemapDiff, list[str]]:
+        """把新快照合并进URL索引并记录变化
+
+        索引为空时（首次运行或旧数据迁移），先用上一份快照初始化。
+        之后只流式遍历一次新快照，新增、删除和lastmod变化都由索引判断，
+        不需要再解压和解析上一份快照。
 
-            # 检查今天是否已经更新过
-            last_update_file = domain_dir / "last_update.txt"
-            today = datetime.now().strftime("%Y%m%d")
-            logging.info(f"今天的日期: {today}")
-
-            # 保存文件
-            current_file = domain_dir / "sitemap-current.xml"
-            latest_file = domain_dir / "sitemap-latest.xml"
-            dated_file = domain_dir / f"{domain}_sitemap_{today}.xml"
-
-            if last_update_file.exists():
-                last_date = last_update_file.read_text().strip()
-                logging.info(f"上次更新日期: {last_date}")
-                if last_date == today:
-                    if (
-                        dated_file.exists()
-                        and current_file.exists()
-                        and latest_file.exists()
-                    ):
-                        current_content = current_file.read_text()
-                        latest_content = latest_file.read_text()
-                        new_urls = self.compare_sitemaps(
-                            current_content, latest_content
-                        )
-                        return True, "今天已经更新过此sitemap, 但没发送", dated_file, new_urls
-                    return (
-                        dated_file.exists(),
-                        "今天已经更新过此sitemap",
-                        dated_file,
-                        [],
-                    )
+        Returns:
+            tuple[SitemapDiff, list[str]]: (相对上一份快照的变化, 第一次出现的URL列表)
+        """
+        try:
+            with UrlIndex(domain_dir / UrlIndex.FILENAME) as index:
+                if not len(index):
+                    if previous is None:
+                        index.seed(snapshot.iter_entries())
+                        return SitemapDiff(), []
+                    index.seed(previous.iter_entries())
+                new_urls, diff = index.merge(snapshot.iter_entries(), snapshot.date)
+
+            store.record_delta(snapshot, diff)
+            if diff:
+                logging.info(
+                    f"sitemap变化: 新增 {len(diff.added)}，删除 {len(diff.removed)}，"
+                    f"更新 {len(diff.modified)}"
+                )
+            return diff, new_urls
+        except Exception as e:
+            logging.error(f"比较sitemap失败: {str(e)}")
+            return SitemapDiff(), []
 
-            # 下载新文件
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
-            }
-            response = requests.get(url, timeout=10, headers=headers)
-            response.raise_for_status()
+    def download_sitemap(
+        self, url: str, check_today: bool = True
+    ) -> tuple[bool, str, Snapshot | None, list[str]]:
+        """下载并保存sitemap文件
 
-            new_urls = []
-            # 如果存在current文件，比较差异
-            if current_file.exists():
-                old_content = current_file.read_text()
-                new_urls = self.compare_sitemaps(response.text, old_content)
-                current_file.replace(latest_file)
+        Args:
+            url: sitemap的URL
+            check_today: 为True时每天只下载一次，由调度器按间隔轮询时为False
 
-            # 保存新文件
-            current_file.write_text(response.text)
-            dated_file.write_text(response.text)  # 临时文件，用于发送到频道后删除
+        Returns:
+            tuple[bool, str, Snapshot | None, list[str]]: (是否成功, 错误信息, 当天的sitemap快照, 新增的URL列表)
+        """
+        try:
+            logging.info(f"尝试下载sitemap: {url}")
+            # 检查今天是否已经更新过
+            cached = self._check_today(url) if check_today else None
+            if cached is not None:
+                return cached
 
-            # 更新最后更新日期
-            last_update_file.write_text(today)
+            # 下载新文件，响应体流式写入临时文件
+            downloaded = self._download_file(url)
+            result = self.http.fetch(
+                url, headers=self._conditional_headers(url), timeout=10, dest=downloaded
+            )
+            self.latency[url] = result.latency
+            if result.not_modified:
+                return self._not_modified(url)
 
-            logging.info(f"sitemap已保存到: {current_file}")
-            return True, "", dated_file, new_urls  # 只添加新URLs返回
+            return self._save_sitemap(url, downloaded, result.headers)
 
         except requests.exceptions.RequestException as e:
+            self._download_file(url).unlink(missing_ok=True)
             return False, f"下载失败: {str(e)}", None, []  # 只添加空列表返回
         except Exception as e:
+            self._download_file(url).unlink(missing_ok=True)
             return False, f"保存失败: {str(e)}", None, []  # 只添加空列表返回
 
-    def add_feed(self, url: str) -> tuple[bool, str, Path | None, list[str]]:
+    async def download_sitemaps(
+        self,
+        urls: list[str],
+        fetcher: SitemapFetcher | None = None,
+        check_today: bool = True,
+    ) -> dict[str, tuple[bool, str, Snapshot | None, list[str]]]:
+        """并发下载多个sitemap
+
+        Args:
+            urls: sitemap的URL列表
+            fetcher: 可选的下载器，默认新建一个并在结束后关闭
+            check_today: 为True时每天只下载一次，由调度器按间隔轮询时为False
+
+        Returns:
+            dict: URL -> download_sitemap格式的结果
+        """
+        results = {}
+        pending = []
+        for url in urls:
+            try:
+                logging.info(f"尝试下载sitemap: {url}")
+                cached = (
+                    await asyncio.to_thread(self._check_today, url) if check_today else None
+                )
+            except Exception as e:
+                results[url] = (False, f"保存失败: {str(e)}", None, [])
+                continue
+            if cached is not None:
+                results[url] = cached
+            elif url not in pending:
+                pending.append(url)
+
+        if pending:
+            dests = [self._download_file(url) for url in pending]
+            headers = [self._conditional_headers(url) for url in pending]
+            if fetcher is None:
+                async with SitemapFetcher(stats=self.http.stats) as own_fetcher:
+                    fetched = await own_fetcher.fetch_many(pending, dests, headers)
+            else:
+                fetched = await fetcher.fetch_many(pending, dests, headers)
+
+            for result in fetched:
+                self.latency[result.url] = result.latency
+            # 压缩、解析和SQLite都是阻塞操作，放到线程中执行，不阻塞事件循环；
+            # 每个feed只读写自己的目录，可以并行
+            stored = await asyncio.gather(
+                *(asyncio.to_thread(self._store_fetched, result) for result in fetched)
+            )
+            for result, outcome in zip(fetched, stored):
+                results[result.url] = outcome
+
+        return {url: results[url] for url in urls}
+
+    def _store_fetched(self, result: FetchResult) -> tuple[bool, str, Snapshot | None, list[str]]:
+        """保存一个异步下载的结果，返回download_sitemap格式的结果"""
+        if not result.ok:
+            self._download_file(result.url).unlink(missing_ok=True)
+            return False, f"下载失败: {result.error}", None, []
+        try:
+            if result.not_modified:
+                return self._not_modified(result.url)
+            return self._save_sitemap(result.url, result.path, result.headers)
+        except Exception as e:
+            self._download_file(result.url).unlink(missing_ok=True)
+            return False, f"保存失败: {str(e)}", None, []
+
+    def _register_feed(
+        self, feeds: list, url: str, result: tuple[bool, str, Snapshot | None, list[str]]
+    ) -> tuple[bool, str, Snapshot | None, list[str]]:
+        """根据下载结果把url加入监控列表，返回add_feed格式的结果"""
+        success, error_msg, snapshot, new_urls = result
+        if not success:
+            return False, error_msg, None, []
+        if url in feeds:
+            # 如果feed已存在，仍然尝试下载（可能是新的一天）
+            if error_msg == NOT_MODIFIED_MSG:
+                return True, f"已存在的feed更新成功, {NOT_MODIFIED_MSG}", snapshot, new_urls
+            return True, "已存在的feed更新成功", snapshot, new_urls
+        # 添加到监控列表
+        feeds.append(url)
+        logging.info(f"成功添加sitemap监控: {url}")
+        return True, "", snapshot, new_urls
+
+    def add_feed(self, url: str) -> tuple[bool, str, Snapshot | None, list[str]]:
         """添加sitemap监控
 
         Args:
             url: sitemap的URL
 
         Returns:
-            tuple[bool, str, Path | None, list[str]]: (是否成功, 错误信息, 带日期的文件路径, 新增的URL列表)
+            tuple[bool, str, Snapshot | None, list[str]]: (是否成功, 错误信息, 当天的sitemap快照, 新增的URL列表)
         """
         try:
             logging.info(f"尝试添加sitemap监控: {url}")
 
             # 验证是否已存在
             feeds = self.get_feeds()
-            if url not in feeds:
-                # 如果是新的feed，先尝试下载
-                success, error_msg, dated_file, new_urls = self.download_sitemap(url)
-                if not success:
-                    return False, error_msg, None, []
-
-                # 添加到监控列表
-                feeds.append(url)
+            is_new = url not in feeds
+            result = self._register_feed(feeds, url, self.download_sitemap(url))
+            if is_new and result[0]:
                 self.feeds_file.write_text(json.dumps(feeds, indent=2))
-                logging.info(f"成功添加sitemap监控: {url}")
-                return True, "", dated_file, new_urls
-            else:
-                # 如果feed已存在，仍然尝试下载（可能是新的一天）
-                success, error_msg, dated_file, new_urls = self.download_sitemap(url)
-                if not success:
-                    return False, error_msg, None, []
-                return True, "已存在的feed更新成功", dated_file, new_urls
+            return result
 
         except Exception as e:
             logging.error(f"添加sitemap监控失败: {url}", exc_info=True)
             return False, f"添加失败: {str(e)}", None, []
 
+    async def add_feeds(
+        self,
+        urls: list[str],
+        fetcher: SitemapFetcher | None = None,
+        check_today: bool = True,
+    ) -> dict[str, tuple[bool, str, Snapshot | None, list[str]]]:
+        """并发添加/更新多个sitemap监控
+
+        Args:
+            urls: sitemap的URL列表
+            fetcher: 可选的下载器
+            check_today: 为True时每天只下载一次，由调度器按间隔轮询时为False
+
+        Returns:
+            dict: URL -> add_feed格式的结果
+        """
+        downloaded = await self.download_sitemaps(urls, fetcher, check_today)
+        feeds = self.get_feeds()
+        feed_count = len(feeds)
+        results = {}
+        for url, result in downloaded.items():
+            try:
+                results[url] = self._register_feed(feeds, url, result)
+            except Exception as e:
+                logging.error(f"添加sitemap监控失败: {url}", exc_info=True)
+                results[url] = (False, f"添加失败: {str(e)}", None, [])
+        if len(feeds) != feed_count:
+            self.feeds_file.write_text(json.dumps(feeds, indent=2))
+        return results
+
     def remove_feed(self, url: str) -> tuple[bool, str]:
         """删除RSS订阅
 
@@ -171,110 +501,147 @@ class RSSManager:
 
     def compare_sitemaps(self, current_content: str, old_content: str) -> list[str]:
         """比较新旧sitemap，返回新增的URL列表"""
-        try:
-            from xml.etree import ElementTree as ET
-
-            current_root = ET.fromstring(current_content)
-            old_root = ET.fromstring(old_content)
-
-            current_urls = set()
-            old_urls = set()
+        return self.compare_sitemap_files(
+            io.StringIO(current_content), io.StringIO(old_content)
+        )
 
-            ns = {"ns": "http://www.sitemaps.org/schemas/sitemap/0.9"}
+    def compare_sitemap_files(self, current_file, old_file) -> list[str]:
+        """流式比较新旧sitemap文件，返回新增的URL列表
 
-            for url in current_root.findall(".//ns:url/ns:loc", ns):
-                current_urls.add(url.text)
+        只在内存中保留旧sitemap URL的哈希集合，峰值内存随URL数量增长，
+        而不是随XML树的大小增长。
 
-            for url in old_root.findall(".//ns:url/ns:loc", ns):
-                old_urls.add(url.text)
-
-            return list(current_urls - old_urls)
+        Args:
+            current_file: 新sitemap的文件路径或文件对象
+            old_file: 旧sitemap的文件路径或文件对象
+        """
+        try:
+            return diff_locs(current_file, old_file)
         except Exception as e:
             logging.error(f"比较sitemap失败: {str(e)}")
             return []
-    def get_all_urls(self, sitemap_url: str) -> list[str]:
+
+    def get_all_urls(
+        self, sitemap_url: str, max_depth: int = 3, concurrency: int = 8
+    ) -> list[str]:
         """
-        从sitemap URL中获取所有URL
+        从sitemap URL中获取所有URL，sitemap索引文件会被并发展开
         
         Args:
             sitemap_url: sitemap的URL
+            max_depth: 索引文件最多展开的层数
+            concurrency: 同时下载的sitemap数量
             
         Returns:
-            list[str]: 所有URL的列表
+            list[str]: 所有URL的列表，有子sitemap获取失败时为空列表
         """
         try:
-            # 设置请求头
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
-            }
-            
-            # 发送请求获取sitemap内容
-            response = requests.get(sitemap_url, timeout=30, headers=headers)
-            response.raise_for_status()
-            
-            return self._parse_sitemap_content(response.text, sitemap_url)
-            
-        except requests.RequestException as e:
-            logging.error(f"请求sitemap失败: {sitemap_url}, 错误: {e}")
-            return []
+            return asyncio.run(
+                self.get_all_urls_async(sitemap_url, max_depth, concurrency)
+            )
         except Exception as e:
             logging.error(f"处理sitemap时发生未知错误: {sitemap_url}, 错误: {e}")
             return []
-    
-    def _parse_sitemap_content(self, content: str, base_url: str = "") -> list[str]:
+
+    async def get_all_urls_async(
+        self, sitemap_url: str, max_depth: int = 3, concurrency: int = 8
+    ) -> list[str]:
         """
-        解析sitemap内容，提取所有URL
+        按层并发展开sitemap索引文件，获取所有URL
+        
+        用visited集合避免索引之间的循环引用，所有子sitemap的结果在最后统一去重。
+        同时下载的sitemap不超过concurrency个，排队的请求不会占用超时时间。
+        任何一个sitemap获取失败都会抛出SitemapCrawlError，而不是返回缺了一部分的URL集合。
         
         Args:
-            content: sitemap的XML内容
-            base_url: 基础URL，用于日志记录
+            sitemap_url: sitemap的URL
+            max_depth: 索引文件最多展开的层数
+            concurrency: 同时下载的sitemap数量
             
         Returns:
             list[str]: 所有URL的列表
+
+        Raises:
+            SitemapCrawlError: 有sitemap下载或解析失败
+        """
+        visited = {sitemap_url}
+        level = [sitemap_url]
+        url_lists = []
+        async with SitemapFetcher(
+            limit=concurrency,
+            limit_per_host=concurrency,
+            timeout=30,
+            stats=self.http.stats,
+        ) as fetcher:
+            slots = asyncio.Semaphore(concurrency)
+            for depth in range(max_depth + 1):
+                expanded = await asyncio.gather(
+                    *(self._expand_sitemap(fetcher, url, slots) for url in level)
+                )
+                failed = [url for url, result in zip(level, expanded) if result is None]
+                if failed:
+                    raise SitemapCrawlError(sitemap_url, failed)
+                next_level = []
+                for children, urls in expanded:
+                    url_lists.append(urls)
+                    for child in children:
+                        if child not in visited:
+                            visited.add(child)
+                            next_level.append(child)
+                if not next_level:
+                    break
+                if depth == max_depth:
+                    logging.warning(
+                        f"sitemap索引超过最大深度 {max_depth}: {sitemap_url}，"
+                        f"忽略 {len(next_level)} 个子sitemap"
+                    )
+                    break
+                level = next_level
+
+        unique_urls = set().union(*url_lists)
+        logging.info(f"总共获取到 {len(unique_urls)} 个唯一URL")
+        return list(unique_urls)
+
+    async def _expand_sitemap(
+        self, fetcher: SitemapFetcher, sitemap_url: str, slots: asyncio.Semaphore
+    ) -> tuple[list[str], list[str]] | None:
         """
-        from xml.etree import ElementTree as ET
+        下载并解析单个sitemap，slots限制同时进行的下载数
         
-        urls = []
+        Returns:
+            tuple[list[str], list[str]] | None: (子sitemap列表, 页面URL列表)，失败时为None
+        """
+        # 本地已有同一份sitemap时使用条件请求
+        async with slots:
+            result = await fetcher.fetch(
+                sitemap_url, headers=self._conditional_headers(sitemap_url)
+            )
+            snapshot = None
+            if result.ok and result.not_modified:
+                store = self.snapshots(sitemap_url)
+                snapshot = store.latest()
+                if snapshot is None or not store.blob_path(snapshot.digest).exists():
+                    # 校验信息还在但快照已经没有了（如存档被重置），当作缓存未命中
+                    logging.warning(f"sitemap返回304但本地没有快照，重新下载: {sitemap_url}")
+                    ValidatorCache(self.feed_dir(sitemap_url)).clear()
+                    snapshot = None
+                    result = await fetcher.fetch(sitemap_url)
+        if not result.ok:
+            return None
         
         try:
-            # 解析XML
-            root = ET.fromstring(content)
-            
-            # 定义命名空间
-            ns = {"sitemap": "http://www.sitemaps.org/schemas/sitemap/0.9"}
-            
-            # 检查是否是sitemap索引文件（包含其他sitemap链接）
-            sitemap_elements = root.findall('.//sitemap:sitemap', ns)
-            if sitemap_elements:
-                logging.info(f"发现sitemap索引文件: {base_url}，包含 {len(sitemap_elements)} 个子sitemap")
-                # 这是一个sitemap索引文件，需要递归获取所有子sitemap的URL
-                for sitemap_elem in sitemap_elements:
-                    loc_elem = sitemap_elem.find('sitemap:loc', ns)
-                    if loc_elem is not None and loc_elem.text:
-                        child_sitemap_url = loc_elem.text.strip()
-                        logging.info(f"正在处理子sitemap: {child_sitemap_url}")
-                        # 递归获取子sitemap的URL
-                        child_urls = self.get_all_urls(child_sitemap_url)
-                        urls.extend(child_urls)
-                        logging.info(f"从子sitemap获取到 {len(child_urls)} 个URL")
+            if snapshot is not None:
+                logging.info(f"sitemap未变化(304)，使用本地快照: {snapshot.date}")
+                with snapshot.open() as f:
+                    children, urls = split_sitemap(f)
             else:
-                # 这是一个普通的sitemap文件，直接提取URL
-                url_elements = root.findall('.//sitemap:url', ns)
-                logging.info(f"发现普通sitemap文件: {base_url}，包含 {len(url_elements)} 个URL")
-                
-                for url_elem in url_elements:
-                    loc_elem = url_elem.find('sitemap:loc', ns)
-                    if loc_elem is not None and loc_elem.text:
-                        urls.append(loc_elem.text.strip())
-            
-            # 去重并返回
-            unique_urls = list(set(urls))
-            logging.info(f"总共获取到 {len(unique_urls)} 个唯一URL")
-            return unique_urls
-            
+                children, urls = split_sitemap(io.BytesIO(result.content))
         except ET.ParseError as e:
-            logging.error(f"解析sitemap XML失败: {base_url}, 错误: {e}")
-            return []
-        except Exception as e:
-            logging.error(f"解析sitemap内容时发生错误: {base_url}, 错误: {e}")
-            return []
\ No newline at end of file
+            logging.error(f"解析sitemap XML失败: {sitemap_url}, 错误: {e}")
+            return None
+        
+        if children:
+            logging.info(f"发现sitemap索引文件: {sitemap_url}，包含 {len(children)} 个子sitemap")
+        else:
+            logging.info(f"发现普通sitemap文件: {sitemap_url}，包含 {len(urls)} 个URL")
+        return children, urls
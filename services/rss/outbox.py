@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from telegram import Bot
+
+from .delivery import TelegramSender, get_sender
+
+# 一条通知：拿到发送器后按顺序发出它的所有消息
+Notification = Callable[[TelegramSender], Awaitable[None]]
+
+
+class Outbox:
+    """集中的异步通知发件箱
+
+    每个目标chat一个队列，队列中的通知按提交顺序逐个发送，
+    所以同一个chat里一个feed的标题、URL和结束消息不会和其他feed交错；
+    不同chat之间并发。每个bot token一个worker，负责实际发送，
+    chat的通知轮流分配给各个bot，多个bot的限流额度可以叠加使用；
+    一个bot同时最多处理concurrency个chat的通知，限流由它的发送器负责。
+    """
+
+    def __init__(self, bots: list[Bot], concurrency: int = 8):
+        if not bots:
+            raise ValueError("Outbox至少需要一个bot")
+        self._senders = [get_sender(bot) for bot in bots]
+        self._bot_queues: list[asyncio.Queue] = []
+        self._chat_queues: dict[str, asyncio.Queue] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._next_bot = 0
+        self.concurrency = concurrency
+
+    async def __aenter__(self) -> "Outbox":
+        for sender in self._senders:
+            queue = asyncio.Queue()
+            self._bot_queues.append(queue)
+            self._tasks.append(asyncio.create_task(self._bot_worker(sender, queue)))
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    def submit(self, chat_id: str, notification: Notification) -> asyncio.Future:
+        """提交一条通知，返回发送完成（或失败）时结束的future"""
+        if not self._bot_queues:
+            raise RuntimeError("Outbox未启动，请使用 async with")
+        key = str(chat_id)
+        if key not in self._chat_queues:
+            queue = asyncio.Queue()
+            self._chat_queues[key] = queue
+            self._tasks.append(asyncio.create_task(self._chat_worker(queue)))
+        done = asyncio.get_running_loop().create_future()
+        self._chat_queues[key].put_nowait((notification, done))
+        return done
+
+    async def join(self) -> None:
+        """等待所有已提交的通知发送完"""
+        for queue in list(self._chat_queues.values()):
+            await queue.join()
+
+    async def close(self) -> None:
+        await self.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._bot_queues.clear()
+        self._chat_queues.clear()
+
+    def _pick_bot_queue(self) -> asyncio.Queue:
+        queue = self._bot_queues[self._next_bot % len(self._bot_queues)]
+        self._next_bot += 1
+        return queue
+
+    async def _chat_worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            notification, done = await queue.get()
+            try:
+                # 等这条通知发完再取下一条，保证chat内的顺序
+                sent = asyncio.get_running_loop().create_future()
+                self._pick_bot_queue().put_nowait((notification, sent))
+                await sent
+                done.set_result(None)
+            except Exception as e:
+                done.set_exception(e)
+            finally:
+                queue.task_done()
+
+    async def _bot_worker(self, sender: TelegramSender, queue: asyncio.Queue) -> None:
+        slots = asyncio.Semaphore(self.concurrency)
+        running = set()
+
+        async def run(notification: Notification, sent: asyncio.Future) -> None:
+            try:
+                await notification(sender)
+                sent.set_result(None)
+            except Exception as e:
+                logging.error(f"发送通知失败: {e}", exc_info=True)
+                sent.set_exception(e)
+            finally:
+                slots.release()
+                queue.task_done()
+
+        try:
+            while True:
+                notification, sent = await queue.get()
+                await slots.acquire()
+                task = asyncio.create_task(run(notification, sent))
+                running.add(task)
+                task.add_done_callback(running.discard)
+        finally:
+            for task in list(running):
+                task.cancel()
@@ -0,0 +1,129 @@
+import hashlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Iterator
+from xml.etree import ElementTree as ET
+
+SITEMAP_NS = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+
+
+def url_key(url: str) -> int:
+    """把URL压缩成有符号64位整数，用于集合成员判断和SQLite主键
+
+    比直接保存URL字符串占用的内存少得多，碰撞概率对sitemap规模可以忽略。
+    """
+    return int.from_bytes(
+        hashlib.blake2b(url.encode(), digest_size=8).digest(), "big", signed=True
+    )
+
+
+def lastmod_key(lastmod: str | None) -> int | None:
+    """<lastmod>的64位哈希，没有lastmod时为None"""
+    return url_key(lastmod) if lastmod else None
+
+
+@dataclass
+class SitemapDiff:
+    """两份sitemap之间的差异"""
+
+    added: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    modified: list[str] = field(default_factory=list)  # 仍然存在但<lastmod>变化的URL
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.modified)
+
+
+def iter_locs(source: str | Path | IO, tag: str = "url") -> Iterator[str]:
+    """流式读取sitemap中的<loc>
+
+    使用iterparse逐个处理元素，处理完立即清理，
+    内存占用不随XML树的大小增长。
+
+    Args:
+        source: 文件路径或文件对象
+        tag: 外层元素名，普通sitemap为url，索引文件为sitemap
+
+    Yields:
+        str: 每个<loc>的URL
+    """
+    outer_tag = f"{SITEMAP_NS}{tag}"
+    loc_tag = f"{SITEMAP_NS}loc"
+    root = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+        if elem.tag != outer_tag:
+            continue
+        loc = elem.find(loc_tag)
+        if loc is not None and loc.text:
+            yield loc.text.strip()
+        # 已处理的元素从根节点上移除，避免整棵树留在内存中
+        root.clear()
+
+
+def iter_entries(source: str | Path | IO) -> Iterator[tuple[str, str | None]]:
+    """流式读取sitemap中每个<url>的<loc>和<lastmod>
+
+    Yields:
+        tuple[str, str | None]: (URL, lastmod)，没有<lastmod>时为None
+    """
+    url_tag = f"{SITEMAP_NS}url"
+    loc_tag = f"{SITEMAP_NS}loc"
+    lastmod_tag = f"{SITEMAP_NS}lastmod"
+    root = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+        if elem.tag != url_tag:
+            continue
+        loc = elem.find(loc_tag)
+        if loc is not None and loc.text:
+            lastmod = elem.find(lastmod_tag)
+            yield loc.text.strip(), (
+                lastmod.text.strip() if lastmod is not None and lastmod.text else None
+            )
+        root.clear()
+
+
+def split_sitemap(source: str | Path | IO) -> tuple[list[str], list[str]]:
+    """一次流式遍历，分别取出索引文件中的子sitemap和普通sitemap中的页面URL
+
+    Returns:
+        tuple[list[str], list[str]]: (子sitemap列表, 页面URL列表)
+    """
+    tags = {f"{SITEMAP_NS}sitemap": [], f"{SITEMAP_NS}url": []}
+    loc_tag = f"{SITEMAP_NS}loc"
+    root = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+        locs = tags.get(elem.tag)
+        if locs is None:
+            continue
+        loc = elem.find(loc_tag)
+        if loc is not None and loc.text:
+            locs.append(loc.text.strip())
+        root.clear()
+    return tags[f"{SITEMAP_NS}sitemap"], tags[f"{SITEMAP_NS}url"]
+
+
+def diff_locs(current_source: str | Path | IO, old_source: str | Path | IO) -> list[str]:
+    """流式比较两个sitemap，返回current中新增的URL（保持文档顺序）"""
+    old_keys = {url_key(loc) for loc in iter_locs(old_source)}
+    seen = set()
+    new_urls = []
+    for loc in iter_locs(current_source):
+        key = url_key(loc)
+        if key in old_keys or key in seen:
+            continue
+        seen.add(key)
+        new_urls.append(loc)
+    return new_urls
+
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from dataclasses import asdict, dataclass, fields
+
+from telegram import Bot
+
+from .commands import bots_from_tokens, notify_feeds, rss_manager
+from .manager import RSSManager
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+@dataclass
+class FeedStats:
+    """单个feed的轮询统计，时间均为unix时间戳/秒"""
+
+    polls: int = 0
+    changes: int = 0
+    failures: int = 0  # 连续失败次数
+    change_interval: float = DAY  # 两次变化之间的平均间隔（EWMA）
+    avg_new_urls: float = 0.0  # 每次变化的平均新增URL数（EWMA）
+    latency: float = 0.0  # 下载耗时（EWMA）
+    interval: float = DAY  # 当前的轮询间隔
+    last_poll: float = 0.0
+    last_change: float = 0.0
+    next_poll: float = 0.0  # 0表示尽快轮询
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "FeedStats":
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class PollScheduler:
+    """按每个feed的变化频率安排sitemap轮询
+
+    每次轮询后更新feed的统计（变化间隔、每次新增的URL数、下载耗时），
+    据此计算下一次轮询时间：
+    - 有变化时，间隔设为平均变化间隔的一半，新增URL越多间隔越短；
+    - 没有变化时，间隔逐次放大backoff倍；
+    - 间隔限制在[min_interval, max_interval]内，下载很慢的feed
+      （如kbhgames的大分片）最短间隔再按耗时放大latency_factor倍；
+    - 下载失败时按min_interval指数退避重试。
+    统计保存在storage/rss/config/schedule.json中，重启后继续使用。
+    """
+
+    FILENAME = "schedule.json"
+
+    def __init__(
+        self,
+        manager: RSSManager = rss_manager,
+        min_interval: float = HOUR,
+        max_interval: float = 3 * DAY,
+        backoff: float = 1.5,
+        alpha: float = 0.3,
+        latency_factor: float = 120,
+    ):
+        self.manager = manager
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.alpha = alpha
+        self.latency_factor = latency_factor
+        self.stats_file = manager.config_dir / self.FILENAME
+        self.stats = self._load()
+
+    def _load(self) -> dict[str, FeedStats]:
+        if not self.stats_file.exists():
+            return {}
+        try:
+            data = json.loads(self.stats_file.read_text())
+        except Exception:
+            logging.warning(f"读取轮询统计失败: {self.stats_file}", exc_info=True)
+            return {}
+        return {url: FeedStats.from_dict(stats) for url, stats in data.items()}
+
+    def save(self) -> None:
+        tmp = self.stats_file.with_suffix(".tmp")
+        tmp.write_text(
+            json.dumps({url: s.to_dict() for url, s in self.stats.items()}, indent=2)
+        )
+        os.replace(tmp, self.stats_file)
+
+    def feed_stats(self, url: str) -> FeedStats:
+        if url not in self.stats:
+            self.stats[url] = FeedStats()
+        return self.stats[url]
+
+    def due(self, now: float | None = None) -> list[str]:
+        """到了轮询时间的feed，按计划时间排序"""
+        now = time.time() if now is None else now
+        feeds = [
+            url for url in self.manager.get_feeds()
+            if self.feed_stats(url).next_poll <= now
+        ]
+        return sorted(feeds, key=lambda url: self.stats[url].next_poll)
+
+    def next_due(self) -> float:
+        """最早的下一次轮询时间"""
+        feeds = self.manager.get_feeds()
+        if not feeds:
+            return time.time() + self.min_interval
+        return min(self.feed_stats(url).next_poll for url in feeds)
+
+    def _ewma(self, average: float, sample: float) -> float:
+        return average + self.alpha * (sample - average)
+
+    def record(
+        self,
+        url: str,
+        success: bool,
+        changed: bool = False,
+        new_count: int = 0,
+        latency: float | None = None,
+        now: float | None = None,
+    ) -> FeedStats:
+        """记录一次轮询的结果并计算下一次轮询时间"""
+        now = time.time() if now is None else now
+        stats = self.feed_stats(url)
+        stats.polls += 1
+        stats.last_poll = now
+        if latency is not None:
+            stats.latency = latency if stats.polls == 1 else self._ewma(stats.latency, latency)
+
+        if not success:
+            stats.failures += 1
+            retry = self.min_interval * 2 ** (stats.failures - 1)
+            stats.next_poll = now + min(stats.interval, retry)
+            return stats
+        stats.failures = 0
+
+        if changed:
+            if stats.last_change:
+                stats.change_interval = self._ewma(
+                    stats.change_interval, now - stats.last_change
+                )
+            stats.last_change = now
+            stats.changes += 1
+            stats.avg_new_urls = self._ewma(stats.avg_new_urls, new_count)
+            # 平均每个变化间隔内至少轮询两次
+            interval = stats.change_interval / 2 / (1 + math.log10(1 + stats.avg_new_urls))
+        else:
+            interval = stats.interval * self.backoff
+
+        shortest = max(self.min_interval, stats.latency * self.latency_factor)
+        stats.interval = min(self.max_interval, max(shortest, interval))
+        stats.next_poll = now + stats.interval
+        return stats
+
+    async def run_once(self, bots: list[Bot], target_chat: str = None) -> dict:
+        """轮询所有到期的feed，推送有新增URL的feed，返回notify_feeds的结果"""
+        urls = self.due()
+        if not urls:
+            return {}
+        logging.info(f"开始轮询 {len(urls)} 个到期的feed")
+        results = await notify_feeds(
+            bots, urls, target_chat, check_today=False, only_updates=True
+        )
+        for url, (success, _, snapshot, new_urls) in results.items():
+            changed = bool(new_urls) or bool(snapshot and snapshot.diff)
+            stats = self.record(
+                url,
+                success,
+                changed=changed,
+                new_count=len(new_urls),
+                latency=self.manager.latency.get(url),
+            )
+            logging.info(
+                f"feed {url}: {'有变化' if changed else '无变化'}，"
+                f"下次轮询间隔 {stats.interval / HOUR:.1f} 小时"
+            )
+        self.save()
+        return results
+
+    async def run_forever(
+        self, bots: list[Bot], target_chat: str = None, max_sleep: float = 15 * 60
+    ) -> None:
+        """循环轮询，每轮结束后睡到最早的下一次轮询时间
+
+        最多睡max_sleep秒，以便及时发现新添加的feed。
+        """
+        while True:
+            try:
+                await self.run_once(bots, target_chat)
+            except Exception as e:
+                logging.error(f"轮询feed失败: {e}", exc_info=True)
+            await asyncio.sleep(min(max_sleep, max(1.0, self.next_due() - time.time())))
+
+
+async def scheduled_task(tokens: str, target_chat: str = None) -> None:
+    """用所有bot共同推送的自适应轮询任务，tokens为逗号分隔的TELEGRAM_TOKEN"""
+    bots = bots_from_tokens(tokens)
+    if not bots:
+        logging.error("未配置TELEGRAM_TOKEN，无法启动sitemap轮询")
+        return
+    await PollScheduler().run_forever(bots, target_chat)
@@ -0,0 +1,304 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, AsyncIterator, Iterator
+
+import zstandard
+
+from .parser import SitemapDiff, iter_entries
+
+
+class FeedLock:
+    """feed目录的排他锁，定时推送和每天的main.py可能同时读写同一个feed
+
+    进程之间用fcntl.flock锁住目录下的.lock文件，进程内用RLock，
+    同一个线程可以重入（如保存快照时调用put）。
+    """
+
+    FILENAME = ".lock"
+    _locks: dict[Path, "FeedLock"] = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    @classmethod
+    def of(cls, feed_dir: Path) -> "FeedLock":
+        path = (Path(feed_dir) / cls.FILENAME).resolve()
+        with cls._locks_guard:
+            if path not in cls._locks:
+                cls._locks[path] = cls(path)
+            return cls._locks[path]
+
+    def __enter__(self) -> "FeedLock":
+        self._rlock.acquire()
+        try:
+            if self._depth == 0:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except BaseException:
+                    os.close(fd)
+                    raise
+                self._fd = fd
+            self._depth += 1
+        except BaseException:
+            self._rlock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._rlock.release()
+
+
+@dataclass
+class Snapshot:
+    """某一天的sitemap快照，内容保存在压缩的blob中"""
+
+    store: "SnapshotStore"
+    date: str  # YYYYMMDD
+    digest: str
+    sent: bool = False
+    diff: SitemapDiff | None = None  # 相对上一份快照的变化，没有比较过时为None
+
+    @property
+    def filename(self) -> str:
+        return f"{self.store.name}_sitemap_{self.date}.xml"
+
+    def open(self) -> IO[bytes]:
+        """以流的方式读取解压后的sitemap"""
+        return self.store.open_blob(self.digest)
+
+    def iter_entries(self) -> Iterator[tuple[str, str | None]]:
+        with self.open() as f:
+            yield from iter_entries(f)
+
+    def _extract(self, directory: Path) -> Path:
+        path = directory / self.filename
+        with self.open() as src, open(path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        return path
+
+    @asynccontextmanager
+    async def materialize_async(self) -> AsyncIterator[Path]:
+        """临时解压出完整的sitemap文件（如发送到Telegram），退出时删除
+
+        解压在线程中进行，不阻塞事件循环。
+        """
+        with tempfile.TemporaryDirectory(dir=self.store.dir) as tmp:
+            yield await asyncio.to_thread(self._extract, Path(tmp))
+
+    def mark_sent(self) -> None:
+        self.store.mark_sent(self.date)
+        self.sent = True
+
+
+class SnapshotStore:
+    """单个feed的sitemap快照存档
+
+    每天的sitemap用zstd压缩后按内容哈希保存在blobs/下，内容相同的日子只存一份；
+    snapshots.json记录每天对应的blob以及是否已经发送，
+    deltas.jsonl逐行记录每次内容变化时相对上一份快照新增、删除和lastmod变化的URL。
+
+    快照以天为单位：同一天轮询多次时，当天的快照是最后一次下载的内容，
+    当天较早的内容只保留在blobs/和deltas.jsonl中。
+
+    修改snapshots.json、cursors.json和deltas.jsonl时持有feed目录的FeedLock。
+    """
+
+    MANIFEST = "snapshots.json"
+    DELTAS = "deltas.jsonl"
+    CURSORS = "cursors.json"
+    BLOB_DIR = "blobs"
+
+    def __init__(self, feed_dir: Path, name: str, level: int = 10):
+        self.dir = Path(feed_dir)
+        self.name = name
+        self.level = level
+        self.blob_dir = self.dir / self.BLOB_DIR
+        self.manifest_file = self.dir / self.MANIFEST
+        self.deltas_file = self.dir / self.DELTAS
+        self.cursors_file = self.dir / self.CURSORS
+
+    def lock(self) -> FeedLock:
+        """feed目录的排他锁，用于需要连续读写多个文件的操作"""
+        return FeedLock.of(self.dir)
+
+    def _load(self) -> dict:
+        if not self.manifest_file.exists():
+            return {}
+        return json.loads(self.manifest_file.read_text())
+
+    def _save(self, manifest: dict) -> None:
+        tmp = self.manifest_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+        os.replace(tmp, self.manifest_file)
+
+    def _snapshot(self, date: str, entry: dict) -> Snapshot:
+        return Snapshot(self, date, entry["digest"], entry.get("sent", False))
+
+    def blob_path(self, digest: str) -> Path:
+        return self.blob_dir / f"{digest}.xml.zst"
+
+    def open_blob(self, digest: str) -> IO[bytes]:
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(self.blob_path(digest), "rb"), closefd=True
+        )
+
+    def get(self, date: str) -> Snapshot | None:
+        """获取某一天保存的快照，那天没有保存时返回None"""
+        entry = self._load().get(date)
+        return self._snapshot(date, entry) if entry else None
+
+    def latest(self, on: str | None = None) -> Snapshot | None:
+        """获取最新的快照，指定on时为当天或之前最近的一份"""
+        manifest = self._load()
+        dates = [d for d in manifest if on is None or d <= on]
+        if not dates:
+            return None
+        date = max(dates)
+        return self._snapshot(date, manifest[date])
+
+    def put(self, source: Path, date: str, sent: bool = False) -> Snapshot:
+        """把source保存为date当天的快照，替换当天已有的快照
+
+        先计算内容哈希，已经存在相同内容的blob时不再压缩和写入。
+        内容和当天已有的快照相同时，保留它的发送状态。
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+
+        blob = self.blob_path(digest)
+        if not blob.exists():
+            self.blob_dir.mkdir(parents=True, exist_ok=True)
+            tmp = blob.with_suffix(".tmp")
+            compressor = zstandard.ZstdCompressor(level=self.level)
+            with open(source, "rb") as src, open(tmp, "wb") as dst:
+                compressor.copy_stream(src, dst)
+            os.replace(tmp, blob)
+
+        with self.lock():
+            manifest = self._load()
+            existing = manifest.get(date)
+            if existing and existing["digest"] == digest:
+                sent = sent or existing.get("sent", False)
+            manifest[date] = {"digest": digest, "sent": sent}
+            self._save(manifest)
+        return Snapshot(self, date, digest, sent)
+
+    def mark_sent(self, date: str) -> None:
+        with self.lock():
+            manifest = self._load()
+            if date in manifest:
+                manifest[date]["sent"] = True
+                self._save(manifest)
+
+    def record_delta(self, snapshot: Snapshot, diff: SitemapDiff) -> None:
+        """追加一条变化记录"""
+        record = {
+            "date": snapshot.date,
+            "digest": snapshot.digest,
+            "added": diff.added,
+            "removed": diff.removed,
+            "modified": diff.modified,
+        }
+        with self.lock(), open(self.deltas_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def deltas(self, since: str | None = None) -> Iterator[dict]:
+        """按时间顺序读取变化记录，指定since时只返回之后的记录"""
+        if not self.deltas_file.exists():
+            return
+        with open(self.deltas_file, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if since is None or record["date"] > since:
+                    yield record
+
+    def read_deltas(self, offset: int = 0) -> tuple[list[dict], int]:
+        """读取deltas.jsonl中offset（字节位置）之后的记录，返回(记录, 新的位置)
+
+        还没写完整的最后一行留到下次读取。
+        """
+        if not self.deltas_file.exists():
+            return [], offset
+        records = []
+        with open(self.deltas_file, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                if line.strip():
+                    records.append(json.loads(line))
+        return records, offset
+
+    def cursor(self, consumer: str) -> int:
+        """consumer在deltas.jsonl中已经读到的位置"""
+        if not self.cursors_file.exists():
+            return 0
+        return json.loads(self.cursors_file.read_text()).get(consumer, 0)
+
+    def set_cursor(self, consumer: str, offset: int) -> None:
+        with self.lock():
+            cursors = (
+                json.loads(self.cursors_file.read_text())
+                if self.cursors_file.exists()
+                else {}
+            )
+            # 位置只前进，不会被较早读到的位置覆盖
+            cursors[consumer] = max(offset, cursors.get(consumer, 0))
+            tmp = self.cursors_file.with_suffix(".tmp")
+            tmp.write_text(json.dumps(cursors, indent=2))
+            os.replace(tmp, self.cursors_file)
+
+    def unread(self, consumer: str) -> tuple[SitemapDiff, int]:
+        """consumer上次确认之后记录的所有变化，合并成一个SitemapDiff
+
+        返回的位置在处理完之后传给set_cursor确认；不确认时下次会再次读到这些变化。
+        """
+        records, offset = self.read_deltas(self.cursor(consumer))
+        added, removed, modified = {}, {}, {}
+        for record in records:
+            for url in record["added"]:
+                removed.pop(url, None)
+                added[url] = None
+            for url in record.get("modified", []):
+                if url not in added:
+                    modified[url] = None
+            for url in record["removed"]:
+                added.pop(url, None)
+                modified.pop(url, None)
+                removed[url] = None
+        return SitemapDiff(list(added), list(removed), list(modified)), offset
+
+    def diff_on(self, date: str) -> SitemapDiff:
+        """某一天记录的变化，当天内容没有变化时为空"""
+        diff = SitemapDiff()
+        for record in self.deltas():
+            if record["date"] == date:
+                diff.added.extend(record["added"])
+                diff.removed.extend(record["removed"])
+                diff.modified.extend(record.get("modified", []))
+        return diff
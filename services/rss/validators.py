@@ -0,0 +1,50 @@
+import json
+import logging
+from pathlib import Path
+
+
+class ValidatorCache:
+    """单个feed的HTTP缓存校验信息（ETag / Last-Modified）
+
+    和last_update.txt一起保存在feed目录下，对应的是最新一份sitemap快照的内容。
+    """
+
+    FILENAME = "validators.json"
+
+    def __init__(self, feed_dir: Path):
+        self.file = Path(feed_dir) / self.FILENAME
+
+    def load(self) -> dict:
+        if not self.file.exists():
+            return {}
+        try:
+            return json.loads(self.file.read_text())
+        except Exception:
+            logging.warning(f"读取校验信息失败: {self.file}", exc_info=True)
+            return {}
+
+    def request_headers(self) -> dict:
+        """构造条件请求头，没有保存过校验信息时返回空字典"""
+        validators = self.load()
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    def store(self, response_headers) -> None:
+        """从响应头中保存校验信息，服务器都没有提供时删除旧的记录"""
+        headers = {k.lower(): v for k, v in response_headers.items()}
+        validators = {
+            "etag": headers.get("etag"),
+            "last_modified": headers.get("last-modified"),
+        }
+        if not any(validators.values()):
+            self.file.unlink(missing_ok=True)
+            return
+        self.file.write_text(json.dumps(validators, indent=2))
+
+    def clear(self) -> None:
+        """删除保存的校验信息，下一次请求不再带条件请求头"""
+        self.file.unlink(missing_ok=True)
@@ -4,6 +4,7 @@ import asyncio
 
 from apps import telegram_bot, discord_bot
 from core.config import discord_config, telegram_config
+from services.rss.scheduler import scheduled_task as sitemap_scheduled_task
 
 
 def main():
@@ -35,8 +36,8 @@ def main():
         if len(tokens) >= 1:
             for tel_token in tokens:
                 tasks.append(telegram_bot.start_task(tel_token))
-                # 为每个bot添加定时任务
-                tasks.append(telegram_bot.scheduled_task(tel_token))
+            # 所有bot共用一个按feed自适应间隔的sitemap轮询任务
+            tasks.append(sitemap_scheduled_task(telegram_token))
 
     try:
         loop.run_until_complete(asyncio.gather(*tasks))
@@ -3,7 +3,6 @@ import logging
 import os
 from pathlib import Path
 from urllib.parse import urljoin, urlparse
-from tqdm import tqdm
 
 # 导入配置和RSS管理器
 from config.config import onetimedomainlist
@@ -84,18 +83,8 @@ def process_domain(domain: str, session) -> tuple[bool, list[str], list[str]]:
         if keyword:
             word_list.append(keyword)
     
-    # 保存关键词到RS表
-    for word in word_list:
-        if word and RS.validate(word) and not RS.exists(word, session.uuid):
-            rs = RS.create(
-                rs=word,
-                rk=f"game-{word}",
-                session_uuid=session.uuid
-            )
-            RS.conn.session.add(rs)
-    
-    # 提交事务
-    RS.conn.session.commit()
+    # 批量保存关键词到RS表
+    RS.bulk_upsert(word_list, "game", session.uuid)
     
     logging.info(f"域名 {domain} 处理成功")
     logging.info(f"总共找到 {len(all_urls)} 个链接")
@@ -149,8 +138,7 @@ def main():
             print("")
     rss = RS.conn.session.query(RS).filter(RS.session_uuid==sess.uuid).all()
 
-    for rs in tqdm(rss, total=len(rss), desc='Collecting Multiline'):
-        collect_multiline(rs, sess=sess)
+    collect_multilines(rss, sess=sess)
     
     return results
 
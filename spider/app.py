@@ -6,12 +6,14 @@ from flask_cors import CORS
 
 from webapp.views.session import session
 from webapp.views.rs import rs
+from webapp.views.jobs import jobs
 
 app = Flask(__name__)
 CORS(app)
 
 app.register_blueprint(session)
 app.register_blueprint(rs)
+app.register_blueprint(jobs)
 
 if __name__ == '__main__':
   app.run(debug=True)
\ No newline at end of file
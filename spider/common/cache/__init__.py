@@ -1,130 +1,269 @@
-import enum, os, asyncio
-from functools import wraps
+import enum, os, asyncio, copy, hashlib, threading
+from concurrent.futures import Future
+from functools import lru_cache, wraps
+from typing import Callable
 
 from pandas import DataFrame
 
+from .memory import MemoryCache
 from .redis import RedisCache
-from common.logger import logger
-from common.utils import md5
-from common.decoutils import extract_real_args
+from .tiered import TieredCache
+from spider.common.logger import logger
+from spider.common.decoutils import is_method
 
 class ReservedKeys(enum.Enum):
   CACHEKEY = '__cachekey__'
   NOCACHE = '__nocache__'
 
+KEY_PREFIX = 'samwise-cache:'
+
+class CacheStats:
+  '''
+    Hit / miss / eviction counters per decorated function ("module:function").
+  '''
+
+  FIELDS = ('hits', 'misses', 'evictions', 'coalesced', 'errors')
+
+  def __init__(self):
+    self._counts = {}
+    self._lock = threading.Lock()
+
+  def record(self, key: str, field: str):
+    name = key[len(KEY_PREFIX):].rsplit(':', 1)[0]
+    with self._lock:
+      counts = self._counts.setdefault(name, dict.fromkeys(self.FIELDS, 0))
+      counts[field] += 1
+
+  def snapshot(self) -> dict:
+    with self._lock:
+      return {name: dict(counts) for name, counts in self._counts.items()}
+
+  def reset(self):
+    with self._lock:
+      self._counts.clear()
+
+stats = CacheStats()
+
+MEMORY_CACHE_SIZE = int(os.environ.get('CACHE_MEMORY_SIZE', 1024))
+
+def _on_evict(key: str):
+  stats.record(key, 'evictions')
+
 class CacheBase(enum.Enum):
+  # 纯内存，用于测试和离线运行
+  MEMORY = MemoryCache(MEMORY_CACHE_SIZE, on_evict=_on_evict)
   REDIS = RedisCache
+  # 进程内LRU + Redis
+  TIERED = TieredCache(MemoryCache(MEMORY_CACHE_SIZE, on_evict=_on_evict), RedisCache)
 
-VALID_ARG_TYPES = (int, str, float, bool)
+@lru_cache(maxsize=None)
+def _backend_override(override: str) -> CacheBase | None:
+  # 每个取值只校验一次，拼错时只记一次日志
+  try:
+    return CacheBase[override.strip().upper()]
+  except KeyError:
+    names = '|'.join(name.lower() for name in CacheBase.__members__)
+    logger.error(f'Unknown CACHE_BACKEND={override!r}, expected {names}; using the decorator\'s backend')
+    return None
 
-def _validate_arg(arg):
-  if isinstance(arg, VALID_ARG_TYPES):
-    return
-  if isinstance(arg, list):
-    for item in arg:
-      _validate_arg(item)
-    return
-  if isinstance(arg, dict):
-    for k, v in arg.items():
-      _validate_arg(k)
-      _validate_arg(v)
-    return
-  if isinstance(arg, enum.Enum):
-    _validate_arg(arg.value)
-    return
-  raise TypeError(f"Invalid argument type: {type(arg)}")
+def _resolve_base(base: CacheBase) -> CacheBase:
+  '''
+    CACHE_BACKEND=memory|redis|tiered overrides the backend chosen by the decorator.
+    An unknown value is ignored.
+  '''
+  override = os.environ.get('CACHE_BACKEND')
+  if not override:
+    return base
+  backend = _backend_override(override)
+  return base if backend is None else backend
 
-def _delete_reserved_keys(kwargs: dict):
-  kwargs = {k: v for k ,v in kwargs.items() if k not in [k.value for k in ReservedKeys]}
-  return kwargs
+VALID_ARG_TYPES = (int, str, float, bool)
+RESERVED_KEYS = frozenset(k.value for k in ReservedKeys)
 
-def _validate_args(func, *args, **kwargs):
-  args, kwargs = extract_real_args(func, *args, **kwargs)
-  if kwargs.get(ReservedKeys.CACHEKEY.value, None) is not None:
-    return
-  for arg in args:
-    _validate_arg(arg)
-  for k, v in kwargs.items():
-    _validate_arg(k)
-    _validate_arg(v)
+def _delete_reserved_keys(kwargs: dict):
+  if RESERVED_KEYS.isdisjoint(kwargs):
+    return kwargs
+  return {k: v for k, v in kwargs.items() if k not in RESERVED_KEYS}
 
-def _strfy_arg(obj):
+def _canonical(obj):
+  '''
+    Validate an argument and normalize it for the key in the same pass:
+    primitives as-is, lists as tuples, dicts item by item, enums by value.
+  '''
   if isinstance(obj, VALID_ARG_TYPES):
-    return str(obj)
+    return obj
   if isinstance(obj, list):
-    return '-'.join([_strfy_arg(item) for item in obj])
+    return tuple([_canonical(item) for item in obj])
   if isinstance(obj, dict):
-    return '-'.join([f"{_strfy_arg(k)}-{_strfy_arg(v)}" for k, v in obj.items()])
+    return {_canonical(k): _canonical(v) for k, v in obj.items()}
   if isinstance(obj, enum.Enum):
-    return _strfy_arg(obj.value)
+    return _canonical(obj.value)
   raise TypeError(f"Invalid argument type: {type(obj)}")
 
-def _format_cachekey(func, key: str):
-  return f"samwise-cache:{func.__module__}:{func.__name__}:{key}"
-
-def _key(func, *args, **kwargs) -> str:
-  if (cachekey := kwargs.pop(ReservedKeys.CACHEKEY.value, None)):
-    return _format_cachekey(func, md5(cachekey))
-  args, kwargs = extract_real_args(func, *args, **kwargs)
-  keystrs = []
-  for arg in args:
-    keystrs.append(_strfy_arg(arg))
-  for k, v in kwargs.items():
-    keystrs.append(f"{_strfy_arg(k)}-{_strfy_arg(v)}")
-  key = md5('.'.join(keystrs))
-  return _format_cachekey(func, key)
+def _digest(data: str | bytes) -> str:
+  if isinstance(data, str):
+    data = data.encode()
+  return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+class _KeyBuilder:
+  '''
+    Cache keys of one decorated function. Whether the first argument is
+    self/cls is decided once here, not with inspect.signature on every call.
+  '''
+
+  def __init__(self, func):
+    self.prefix = f"{KEY_PREFIX}{func.__module__}:{func.__name__}:"
+    self.skip_self = bool(is_method(func))
+
+  def real_args(self, args: tuple, kwargs: dict) -> tuple[tuple, dict]:
+    return (args[1:] if self.skip_self else args), _delete_reserved_keys(kwargs)
+
+  def __call__(self, args: tuple, kwargs: dict) -> str:
+    if (cachekey := kwargs.get(ReservedKeys.CACHEKEY.value)) is not None:
+      return self.prefix + _digest(cachekey)
+    args, kwargs = self.real_args(args, kwargs)
+    # 关键字参数按名字排序，f(a=1, b=2) 和 f(b=2, a=1) 是同一个key
+    payload = (
+      tuple([_canonical(arg) for arg in args]),
+      tuple(sorted((k, _canonical(v)) for k, v in kwargs.items()))
+    )
+    return self.prefix + _digest(repr(payload))
 
 def _use_cache(**kwargs):
   nocache = kwargs.pop(ReservedKeys.NOCACHE.value, False)
   SYS_USE_CACHE = int(os.environ.get('USE_REDIS_CACHE', 1)) > 0
   return not nocache and SYS_USE_CACHE
 
-def _sync_apply(base: CacheBase, key, expiration, func, *args, **kwargs):
+def _expiration_for(expiration: int | Callable, keys: _KeyBuilder, args: tuple, kwargs: dict) -> int:
+  if not callable(expiration):
+    return expiration
+  args, kwargs = keys.real_args(args, kwargs)
+  return expiration(*args, **kwargs)
+
+def _put(base: CacheBase, key, result, expiration):
+  try:
+    base.value.put(key, result, expiration)
+  except Exception as e:
+    stats.record(key, 'errors')
+    logger.error(f'写入缓存失败: {key}, {e}')
+
+def _store(base: CacheBase, key, result, cacheable: Callable | None, expiration):
+  if cacheable is not None and not cacheable(result):
+    logger.info(f'结果无效，不写入缓存: {key}')
+    return
+  _put(base, key, result, expiration)
+
+def _sync_apply(base: CacheBase, key, expiration, cacheable, keys: _KeyBuilder, func, *args, **kwargs):
   result = func(*args, **_delete_reserved_keys(kwargs))
-  base.value.put(key, result, expiration)
-  return base.value.get(key)
+  _store(base, key, result, cacheable, _expiration_for(expiration, keys, args, kwargs))
+  return result
 
-async def _async_apply(base: CacheBase, key, expiration, func, *args, **kwargs):
+async def _async_apply(base: CacheBase, key, expiration, cacheable, keys: _KeyBuilder, func, *args, **kwargs):
   result = await func(*args, **_delete_reserved_keys(kwargs))
-  base.value.put(key, result, expiration)
+  _store(base, key, result, cacheable, _expiration_for(expiration, keys, args, kwargs))
   return result
 
 def _fetch_in_cache(base: CacheBase, key):
+  # 命中只计数不打日志，热点函数上每次命中都写日志的开销比函数本身还大
   cached_result = base.value.get(key)
   if cached_result is not None:
-    logger.info(f"缓存命中: {key}")
+    stats.record(key, 'hits')
     return cached_result
   else:
+    stats.record(key, 'misses')
     logger.info(f"缓存未命中: {key}")
     return None
-  
-def _validate_and_get_key(func, *args, **kwargs) -> str:
-  _validate_args(func, *args, **kwargs)
-  return _key(func, *args, **kwargs)
 
-def _decorate(base: CacheBase, expiration: int):
+# 正在请求中的key，相同的并发调用等待同一个结果
+_inflight: dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+_async_inflight: dict[str, asyncio.Future] = {}
+
+def _sync_coalesced(apply, key):
+  with _inflight_lock:
+    future = _inflight.get(key)
+    leader = future is None
+    if leader:
+      future = _inflight[key] = Future()
+  if not leader:
+    stats.record(key, 'coalesced')
+    logger.info(f"合并请求: {key}")
+    # 调用方可能会原地修改结果，每个等待者拿到自己的副本
+    return copy.deepcopy(future.result())
+  try:
+    result = apply()
+    future.set_result(result)
+    return result
+  except BaseException as e:
+    future.set_exception(e)
+    raise
+  finally:
+    with _inflight_lock:
+      del _inflight[key]
+
+async def _async_coalesced(apply, key):
+  future = _async_inflight.get(key)
+  if future is not None and future.get_loop() is asyncio.get_running_loop():
+    stats.record(key, 'coalesced')
+    logger.info(f"合并请求: {key}")
+    return copy.deepcopy(await asyncio.shield(future))
+  future = _async_inflight[key] = asyncio.get_running_loop().create_future()
+  try:
+    result = await apply()
+    future.set_result(result)
+    return result
+  except BaseException as e:
+    future.set_exception(e)
+    # 没有等待者时也不要报 "exception was never retrieved"
+    future.exception()
+    raise
+  finally:
+    if _async_inflight.get(key) is future:
+      del _async_inflight[key]
+
+def _decorate(base: CacheBase, expiration: int | Callable, coalesce: bool = False, cacheable: Callable = None):
   def decorator(func):
+    keys = _KeyBuilder(func)
+
     @wraps(func)
     def sync_wrapper(*args, **kwargs):
-      key = _validate_and_get_key(func, *args, **kwargs)
-      if _use_cache(**kwargs):
+      backend = _resolve_base(base)
+      key = keys(args, kwargs)
+      if not _use_cache(**kwargs):
+        return _sync_apply(backend, key, expiration, cacheable, keys, func, *args, **kwargs)
+
+      def apply():
         try:
-          if (result := _fetch_in_cache(base, key)) is not None:
+          if (result := _fetch_in_cache(backend, key)) is not None:
             return result
         except ModuleNotFoundError as e:
           logger.error(f'{e}, using remote resource')
-      return _sync_apply(base, key, expiration, func, *args, **kwargs)
+        except Exception as e:
+          stats.record(key, 'errors')
+          logger.error(f'读取缓存失败: {key}, {e}, using remote resource')
+        return _sync_apply(backend, key, expiration, cacheable, keys, func, *args, **kwargs)
+
+      return _sync_coalesced(apply, key) if coalesce else apply()
       
     @wraps(func)
     async def async_wrapper(*args, **kwargs):
-      key = _validate_and_get_key(func, *args, **kwargs)
-      if _use_cache(**kwargs):
+      backend = _resolve_base(base)
+      key = keys(args, kwargs)
+      if not _use_cache(**kwargs):
+        return await _async_apply(backend, key, expiration, cacheable, keys, func, *args, **kwargs)
+
+      async def apply():
         try: 
-          if (result := _fetch_in_cache(base, key)) is not None:
+          if (result := _fetch_in_cache(backend, key)) is not None:
             return result
         except ModuleNotFoundError as e:
           logger.error(f'{e}, using remote resource')
-      return await _async_apply(base, key, expiration, func, *args, **kwargs)
+        except Exception as e:
+          stats.record(key, 'errors')
+          logger.error(f'读取缓存失败: {key}, {e}, using remote resource')
+        return await _async_apply(backend, key, expiration, cacheable, keys, func, *args, **kwargs)
+
+      return await (_async_coalesced(apply, key) if coalesce else apply())
     
     if asyncio.iscoroutinefunction(func):
       return async_wrapper
@@ -133,6 +272,24 @@ def _decorate(base: CacheBase, expiration: int):
   return decorator
 
 class Cache:
+  '''
+    expiration: seconds, or a function of the call's arguments returning seconds
+    coalesce: concurrent calls with the same key share one underlying call
+    cacheable: a function of the result; results it rejects are returned but not cached
+  '''
+
+  @staticmethod
+  def redis(expiration: int | Callable = 86400, coalesce: bool = False, cacheable: Callable = None):
+    return _decorate(CacheBase.REDIS, expiration, coalesce, cacheable)
+
+  @staticmethod
+  def memory(expiration: int | Callable = 86400, coalesce: bool = False, cacheable: Callable = None):
+    return _decorate(CacheBase.MEMORY, expiration, coalesce, cacheable)
+
+  @staticmethod
+  def tiered(expiration: int | Callable = 86400, coalesce: bool = False, cacheable: Callable = None):
+    return _decorate(CacheBase.TIERED, expiration, coalesce, cacheable)
+
   @staticmethod
-  def redis(expiration=86400):
-    return _decorate(CacheBase.REDIS, expiration)
\ No newline at end of file
+  def stats() -> dict:
+    return stats.snapshot()
@@ -0,0 +1,34 @@
+'''
+  Per-call overhead of the cache decorator on a cache hit.
+
+    python -m spider.common.cache.benchmark
+'''
+import os, timeit
+
+os.environ['CACHE_BACKEND'] = 'memory'
+
+from spider.common.cache import Cache, _KeyBuilder
+
+class Client:
+  def query(self, keywords: list[str], timeframe: str, geo: str):
+    return keywords
+
+  @Cache.memory()
+  def cached_query(self, keywords: list[str], timeframe: str, geo: str):
+    return keywords
+
+def main(number: int = 20000):
+  client = Client()
+  args = (client, ['keyword one', 'gpts'], 'today 1-m', 'US')
+  keys = _KeyBuilder(Client.query)
+  client.cached_query(*args[1:])
+  results = {
+    'plain call': timeit.timeit(lambda: client.query(*args[1:]), number=number),
+    'key derivation': timeit.timeit(lambda: keys(args, {}), number=number),
+    'cached call (hit)': timeit.timeit(lambda: client.cached_query(*args[1:]), number=number),
+  }
+  for name, seconds in results.items():
+    print(f'{name:<20} {seconds / number * 1e6:8.2f} us/call')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,44 @@
+import threading, time
+from collections import OrderedDict
+from typing import Callable
+
+class MemoryCache:
+  '''
+    In-process LRU cache with per-entry TTL. Values are stored as-is (no
+    pickling), so callers must treat cached values as read-only.
+    `on_evict(key)` is called for entries dropped to stay under maxsize.
+  '''
+
+  def __init__(self, maxsize: int = 1024, on_evict: Callable[[str], None] = None):
+    self.maxsize = maxsize
+    self.on_evict = on_evict
+    self._data = OrderedDict()  # key -> (expires_at, value)
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._data)
+
+  def put(self, key, value, expiration=86400):
+    with self._lock:
+      self._data[key] = (time.monotonic() + expiration, value)
+      self._data.move_to_end(key)
+      while len(self._data) > self.maxsize:
+        evicted, _ = self._data.popitem(last=False)
+        if self.on_evict:
+          self.on_evict(evicted)
+
+  def get(self, key):
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is None:
+        return None
+      expires_at, value = entry
+      if expires_at <= time.monotonic():
+        del self._data[key]
+        return None
+      self._data.move_to_end(key)
+      return value
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
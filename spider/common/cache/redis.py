@@ -1,18 +1,24 @@
 import pickle
 
-import redis
+from spider.common import config
 
-from common import config
+_redis_client = None
 
-redis_client = redis.Redis(host=config.redis_host, password=config.redis_pass, port=6379, db=0)
+def redis_client():
+  # 用到时才导入和连接，没有安装redis时只影响Redis缓存本身
+  global _redis_client
+  if _redis_client is None:
+    import redis
+    _redis_client = redis.Redis(host=config.redis_host, password=config.redis_pass, port=6379, db=0)
+  return _redis_client
 
 class RedisCache:
 
   @staticmethod
   def put(key, value, expiration=86400):
-    redis_client.setex(key, expiration, pickle.dumps(value))
+    redis_client().setex(key, expiration, pickle.dumps(value))
 
   @staticmethod
   def get(key):
-    cached_result = redis_client.get(key)
-    return pickle.loads(cached_result) if cached_result else None
\ No newline at end of file
+    cached_result = redis_client().get(key)
+    return pickle.loads(cached_result) if cached_result else None
@@ -0,0 +1,26 @@
+from .memory import MemoryCache
+
+class TieredCache:
+  '''
+    A local MemoryCache in front of a shared remote cache. Hits on the local
+    tier skip the network round-trip and unpickling; remote hits are copied
+    into the local tier for at most `local_ttl` seconds, so entries written
+    by other processes are picked up without staying stale for long.
+  '''
+
+  def __init__(self, local: MemoryCache, remote, local_ttl: int = 600):
+    self.local = local
+    self.remote = remote
+    self.local_ttl = local_ttl
+
+  def put(self, key, value, expiration=86400):
+    self.local.put(key, value, min(expiration, self.local_ttl))
+    self.remote.put(key, value, expiration)
+
+  def get(self, key):
+    if (value := self.local.get(key)) is not None:
+      return value
+    value = self.remote.get(key)
+    if value is not None:
+      self.local.put(key, value, self.local_ttl)
+    return value
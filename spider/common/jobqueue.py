@@ -0,0 +1,84 @@
+import threading, time, traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from uuid import uuid4
+
+from spider.common.logger import logger
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+class JobQueue:
+  '''
+    Local background worker pool for request handlers: submit() returns a job
+    id right away and the work runs on one of `workers` threads. Jobs with the
+    same key share one run while it is queued or running. Finished jobs are
+    kept for `ttl` seconds so their status can still be polled. `teardown`
+    runs on the worker thread after every job, e.g. to release the thread's
+    database session.
+  '''
+
+  def __init__(self, workers: int = 4, ttl: float = 3600, teardown: Callable = None):
+    self.ttl = ttl
+    self.teardown = teardown
+    self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+    self._jobs = {}
+    self._active = {}  # key -> 排队或运行中的job id
+    self._lock = threading.Lock()
+
+  def submit(self, fn: Callable, *args, key: str = None, **kwargs) -> str:
+    with self._lock:
+      self._expire()
+      if key is not None and key in self._active:
+        return self._active[key]
+      job_id = uuid4().hex
+      self._jobs[job_id] = {
+        'id': job_id,
+        'status': QUEUED,
+        'result': None,
+        'error': None,
+        'created_at': time.time(),
+        'finished_at': None
+      }
+      if key is not None:
+        self._active[key] = job_id
+    self._executor.submit(self._run, job_id, key, fn, args, kwargs)
+    return job_id
+
+  def get(self, job_id: str) -> dict | None:
+    with self._lock:
+      job = self._jobs.get(job_id)
+      return dict(job) if job else None
+
+  def _run(self, job_id: str, key: str, fn: Callable, args: tuple, kwargs: dict):
+    self._update(job_id, status=RUNNING)
+    try:
+      result = fn(*args, **kwargs)
+    except Exception as e:
+      logger.warning(f'Job {job_id} failed: {e}')
+      traceback.print_exc()
+      self._update(job_id, key, status=FAILED, error=str(e), finished_at=time.time())
+    else:
+      self._update(job_id, key, status=DONE, result=result, finished_at=time.time())
+    finally:
+      if self.teardown is not None:
+        try:
+          self.teardown()
+        except Exception as e:
+          logger.warning(f'Teardown after job {job_id} failed: {e}')
+
+  def _update(self, job_id: str, key: str = None, **fields):
+    with self._lock:
+      self._jobs[job_id].update(fields)
+      if key is not None and fields.get('finished_at'):
+        self._active.pop(key, None)
+
+  def _expire(self):
+    deadline = time.time() - self.ttl
+    for job_id in [
+      job_id for job_id, job in self._jobs.items()
+      if job['finished_at'] and job['finished_at'] < deadline
+    ]:
+      del self._jobs[job_id]
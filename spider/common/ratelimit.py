@@ -0,0 +1,35 @@
+import threading, time
+
+class TokenBucket:
+  '''
+    Thread-safe token bucket shared by all workers of a job.
+    `rate` tokens are added per second, up to `capacity`.
+  '''
+
+  def __init__(self, rate: float, capacity: int = 1):
+    self.rate = rate
+    self.capacity = capacity
+    self._tokens = float(capacity)
+    self._updated = time.monotonic()
+    self._lock = threading.Lock()
+
+  def _refill(self):
+    now = time.monotonic()
+    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+    self._updated = now
+
+  def try_acquire(self) -> float:
+    '''
+      Take a token if one is available.
+      Returns 0 on success, otherwise the seconds until the next token.
+    '''
+    with self._lock:
+      self._refill()
+      if self._tokens >= 1:
+        self._tokens -= 1
+        return 0
+      return (1 - self._tokens) / self.rate
+
+  def acquire(self):
+    while (wait := self.try_acquire()) > 0:
+      time.sleep(wait)
@@ -0,0 +1,114 @@
+import heapq, itertools, random, threading, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable
+
+@dataclass(frozen=True)
+class RetryPolicy:
+  '''
+    How often and how late a failed item is tried again.
+    The n-th retry waits base * factor ** (n - 1) seconds, capped at
+    max_delay and spread by +-jitter so failed items don't retry in lockstep.
+  '''
+  max_attempts: int = 5
+  base: float = 10
+  factor: float = 2
+  max_delay: float = 300
+  jitter: float = 0.5
+
+  def delay(self, attempt: int) -> float:
+    delay = min(self.base * self.factor ** (attempt - 1), self.max_delay)
+    return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+NO_RETRY = RetryPolicy(max_attempts=1)
+
+# 匹配规则：异常类型，或者接收异常返回bool的函数
+ErrorMatcher = type[BaseException] | Callable[[BaseException], bool]
+
+class RetryScheduler:
+  '''
+    Runs fn(item) for many items on a thread pool. A failed item is put on a
+    delayed queue according to the first policy matching its error, and the
+    workers go on with other items meanwhile, so a flaky item never blocks
+    the pipeline. Items are given up once their policy's max_attempts is hit.
+  '''
+
+  def __init__(
+    self,
+    policies: list[tuple[ErrorMatcher, RetryPolicy]] = (),
+    default: RetryPolicy = RetryPolicy(),
+    workers: int = 4
+  ):
+    self.policies = list(policies)
+    self.default = default
+    self.workers = workers
+    self.stats = {'done': 0, 'retries': 0, 'given_up': 0}
+    self._lock = threading.Lock()
+
+  def policy_for(self, error: BaseException) -> RetryPolicy:
+    for matcher, policy in self.policies:
+      if isinstance(matcher, type):
+        if isinstance(error, matcher):
+          return policy
+      elif matcher(error):
+        return policy
+    return self.default
+
+  def _count(self, key: str):
+    with self._lock:
+      self.stats[key] += 1
+
+  def run(
+    self,
+    items: list,
+    fn: Callable[[Any], Any],
+    on_done: Callable[[Any, Any], None] = None,
+    on_retry: Callable[[Any, BaseException, int, float], None] = None,
+    on_give_up: Callable[[Any, BaseException], None] = None
+  ) -> dict:
+    '''
+      Process all items and return the stats once every item is done or given up.
+      Callbacks run on the calling thread:
+        on_done(item, result)
+        on_retry(item, error, attempt, delay)
+        on_give_up(item, error)
+    '''
+    seq = itertools.count()
+    # (ready_at, seq, item, attempt)
+    delayed = [(0.0, next(seq), item, 1) for item in items]
+    heapq.heapify(delayed)
+    running = {}
+    with ThreadPoolExecutor(max_workers=self.workers) as executor:
+      while delayed or running:
+        now = time.monotonic()
+        while delayed and delayed[0][0] <= now and len(running) < self.workers:
+          _, _, item, attempt = heapq.heappop(delayed)
+          running[executor.submit(fn, item)] = (item, attempt)
+        # worker都在忙时到期的重试也提交不了，只等有任务完成，否则会空转
+        timeout = max(0, delayed[0][0] - now) if delayed and len(running) < self.workers else None
+        if not running:
+          # 只剩等待重试的条目，没有可以执行的
+          time.sleep(timeout)
+          continue
+        finished, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in finished:
+          item, attempt = running.pop(future)
+          try:
+            result = future.result()
+          except Exception as e:
+            policy = self.policy_for(e)
+            if attempt >= policy.max_attempts:
+              self._count('given_up')
+              if on_give_up:
+                on_give_up(item, e)
+              continue
+            delay = policy.delay(attempt)
+            self._count('retries')
+            if on_retry:
+              on_retry(item, e, attempt, delay)
+            heapq.heappush(delayed, (time.monotonic() + delay, next(seq), item, attempt + 1))
+          else:
+            self._count('done')
+            if on_done:
+              on_done(item, result)
+    return self.stats
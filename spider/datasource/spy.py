@@ -1,39 +1,140 @@
+from contextlib import contextmanager
+from datetime import date
+from queue import Queue
 from random import randint
+from uuid import uuid4
 
 from fake_useragent import UserAgent
+from pandas import DataFrame
 from trendspy import Trends
 
 from webapp.model.session import Session
 from common.config import proxy
 from common.const import TopWebsites
+from spider.common.cache import Cache
 
 ua = UserAgent()
+# Google Trends 每次最多比较5个词，留一个给参照词
+MAX_BATCH_KEYWORDS = 4
+
+proxies = [p.strip() for p in proxy.split(',') if p.strip()]
 
 def get_random_referer():
   return f'https://{TopWebsites[randint(0, len(TopWebsites) - 1)]}'
 
+HOUR = 3600
+DAY = 24 * HOUR
+
+def trends_ttl(timeframe: str) -> int:
+  '''
+    How long a Trends result for `timeframe` stays useful: rolling windows with
+    minute/hourly points change quickly, daily and weekly series at most once
+    a day, and a range that already ended never changes.
+  '''
+  timeframe = timeframe.strip()
+  if timeframe.startswith('now'):
+    # now 1-H / now 4-H / now 1-d 是分钟级数据，now 7-d 是小时级数据
+    return HOUR if timeframe.endswith('7-d') else 10 * 60
+  if timeframe.startswith('today'):
+    return 12 * HOUR if timeframe.endswith(('1-m', '3-m')) else 3 * DAY
+  if timeframe == 'all':
+    return 3 * DAY
+  try:
+    end = date.fromisoformat(timeframe.split()[-1])
+  except ValueError:
+    return HOUR
+  return 7 * DAY if end < date.today() else 12 * HOUR
+
+def rotate_proxy(index: int) -> str:
+  '''
+    Pick the proxy for the index-th client from the comma separated
+    common.config.proxy. Bright Data super proxies get a random session id so
+    every client exits through its own IP.
+  '''
+  selected = proxies[index % len(proxies)]
+  if 'superproxy.io' not in selected or '@' not in selected:
+    return selected
+  auth, host = selected.split('@', 1)
+  user, password = auth.split(':', 1)
+  return f'{user}-session-{uuid4().hex[:12]}:{password}@{host}'
+
+def has_rising(result) -> bool:
+  # 空的或者格式不对的结果不缓存，否则在TTL内会一直返回同样的坏数据
+  rising = result.get('rising') if isinstance(result, dict) else None
+  return isinstance(rising, DataFrame) and not rising.empty
+
+def is_nonempty_frame(result) -> bool:
+  return isinstance(result, DataFrame) and not result.empty
+
 class Spy:
   
-  def __init__(self, delay: int = 0):
+  def __init__(self, delay: int = 0, proxy: str = proxy):
     self.spy = Trends(request_delay=2 + 60 * delay, proxy=proxy)
 
-  def query_related_search(self, keyword: str, sess: Session):
-    referer = get_random_referer()
-    res = self.spy.related_queries(
+  @Cache.tiered(
+    expiration=lambda keyword, timeframe, geo: trends_ttl(timeframe),
+    coalesce=True,
+    cacheable=has_rising
+  )
+  def related_queries(self, keyword: str, timeframe: str, geo: str):
+    '''
+      Cached on (keyword, timeframe, geo); identical concurrent calls share one request.
+    '''
+    return self.spy.related_queries(
       keyword,
-      timeframe=sess.timeframe,
-      geo=sess.geo,
-      headers={'referer': referer}
+      timeframe=timeframe,
+      geo=geo,
+      headers={'referer': get_random_referer()}
+    )
+
+  @Cache.tiered(
+    expiration=lambda keywords, timeframe, geo: trends_ttl(timeframe),
+    coalesce=True,
+    cacheable=is_nonempty_frame
+  )
+  def interest_over_time(self, keywords: list[str], timeframe: str, geo: str):
+    '''
+      Cached on (keywords incl. the reference, timeframe, geo);
+      identical concurrent calls share one request.
+    '''
+    return self.spy.interest_over_time(
+      keywords,
+      timeframe=timeframe,
+      geo=geo,
+      headers={'referer': get_random_referer()}
     )
-    return res
+
+  def query_related_search(self, keyword: str, sess: Session):
+    return self.related_queries(keyword, sess.timeframe, sess.geo)
   
   def query_multiline(self, keyword: str, sess: Session, reference: str = 'gpts'):
-    referer = get_random_referer()
-    res = self.spy.interest_over_time(
-      [keyword, reference],
-      timeframe=sess.timeframe,
-      geo=sess.geo,
-      headers={'referer': referer}
-    )
-    return res, reference
- 
\ No newline at end of file
+    return self.interest_over_time([keyword, reference], sess.timeframe, sess.geo), reference
+
+  def query_multiline_batch(self, keywords: list[str], sess: Session, reference: str = 'gpts'):
+    '''
+      Query up to MAX_BATCH_KEYWORDS keywords in one interest_over_time call,
+      compared against the same reference. Split the frame with
+      Multiline.create_many_from_df.
+    '''
+    if len(keywords) > MAX_BATCH_KEYWORDS:
+      raise ValueError(f'At most {MAX_BATCH_KEYWORDS} keywords per request, got {len(keywords)}')
+    return self.interest_over_time([*keywords, reference], sess.timeframe, sess.geo), reference
+
+class SpyPool:
+  '''
+    A fixed set of Spy clients, each behind its own rotated proxy,
+    shared by the workers of a concurrent job.
+  '''
+
+  def __init__(self, size: int, delay: int = 0):
+    self._clients = Queue()
+    for i in range(size):
+      self._clients.put(Spy(delay, proxy=rotate_proxy(i)))
+
+  @contextmanager
+  def client(self):
+    spy = self._clients.get()
+    try:
+      yield spy
+    finally:
+      self._clients.put(spy)
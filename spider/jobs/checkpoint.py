@@ -0,0 +1,87 @@
+import enum, json, os, threading
+
+class State(str, enum.Enum):
+  PENDING = 'pending'
+  DONE = 'done'
+  FAILED = 'failed'      # 失败过，还会重试
+  GIVEN_UP = 'given_up'  # 重试次数用完或数据无效，不再处理
+
+TERMINAL_STATES = (State.DONE, State.GIVEN_UP)
+
+class Checkpoint:
+  '''
+    Per-session progress of a collection job, kept in .checkpoints/<uuid>.jsonl
+    so a crashed job can be resumed on the same session instead of starting over.
+    Items are grouped by kind, e.g. 'rk' for root keywords and 'rs' for RS rows.
+    Every mark appends one line per key, and loading replays the lines in order,
+    so marking costs the same however many items are already recorded.
+  '''
+
+  DIR = '.checkpoints'
+
+  def __init__(self, session_uuid: str, directory: str = DIR):
+    self.session_uuid = session_uuid
+    self.path = os.path.join(directory, f'{session_uuid}.jsonl')
+    self._lock = threading.Lock()
+    self._items = {}
+    # 上次写到一半崩溃时，文件不以换行结尾，下一次追加要先换行
+    self._torn = False
+    if os.path.exists(self.path):
+      self._load()
+
+  def _load(self):
+    with open(self.path) as f:
+      for line in f:
+        self._torn = not line.endswith('\n')
+        try:
+          record = json.loads(line)
+        except json.JSONDecodeError:
+          # 写到一半就崩溃的最后一行
+          continue
+        kind, key = record.pop('kind'), record.pop('key')
+        self._items.setdefault(kind, {})[key] = record
+
+  def _entry(self, kind: str, key: str) -> dict:
+    return self._items.get(kind, {}).get(key, {})
+
+  def state(self, kind: str, key: str) -> State:
+    return State(self._entry(kind, key).get('state', State.PENDING))
+
+  def attempts(self, kind: str, key: str) -> int:
+    return self._entry(kind, key).get('attempts', 0)
+
+  def is_finished(self, kind: str, key: str) -> bool:
+    return self.state(kind, key) in TERMINAL_STATES
+
+  def mark(self, kind: str, keys: str | list[str], state: State, error: str = None):
+    keys = [keys] if isinstance(keys, str) else keys
+    if not keys:
+      return
+    with self._lock:
+      items = self._items.setdefault(kind, {})
+      for key in keys:
+        entry = items.setdefault(key, {'state': State.PENDING.value, 'attempts': 0})
+        entry['state'] = state.value
+        if state == State.FAILED:
+          entry['attempts'] += 1
+        if error is not None:
+          entry['error'] = error
+      self._append(kind, keys)
+
+  def summary(self, kind: str) -> dict:
+    counts = {state.value: 0 for state in State}
+    for entry in self._items.get(kind, {}).values():
+      counts[entry['state']] += 1
+    return counts
+
+  def _append(self, kind: str, keys: list[str]):
+    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    items = self._items[kind]
+    lines = ''.join(
+      json.dumps({'kind': kind, 'key': key, **items[key]}) + '\n' for key in keys
+    )
+    if self._torn:
+      lines = '\n' + lines
+      self._torn = False
+    with open(self.path, 'a') as f:
+      f.write(lines)
@@ -0,0 +1,275 @@
+import json, threading
+
+from requests import HTTPError
+from tqdm import tqdm
+from trendspy.client import TrendsQuotaExceededError
+
+from datasource.spy import Spy, SpyPool, MAX_BATCH_KEYWORDS
+from webapp.model.session import Session
+from webapp.model.rs import RS
+from webapp.model.multiline import Multiline
+from jobs.checkpoint import Checkpoint, State
+from spider.common.ratelimit import TokenBucket
+from spider.common.retry import NO_RETRY, RetryPolicy, RetryScheduler
+from spider.common.logger import logger
+
+def is_rate_limited(error: BaseException) -> bool:
+  if isinstance(error, TrendsQuotaExceededError):
+    return True
+  response = getattr(error, 'response', None)
+  return isinstance(error, HTTPError) and response is not None and response.status_code in (429, 302)
+
+# 按顺序匹配，第一个命中的策略生效
+TRENDS_RETRY_POLICIES = [
+  # 被限流时退避要久一些，让代理IP冷却
+  (is_rate_limited, RetryPolicy(max_attempts=6, base=60, max_delay=900)),
+  # IndexError: 没有rising数据；AttributeError: 返回的数据无效，重试也没有用
+  (IndexError, NO_RETRY),
+  (AttributeError, NO_RETRY),
+  # 解析失败多半是返回了异常页面，少重试几次
+  (json.JSONDecodeError, RetryPolicy(max_attempts=3, base=30)),
+  (KeyError, RetryPolicy(max_attempts=3, base=30)),
+]
+
+# 同一进程里的所有采集（批处理job和web后台job）共用一个限速器和一个客户端池，
+# 几个job同时运行时打到Trends的总速率也不超过TRENDS_RATE
+TRENDS_RATE = 0.5
+TRENDS_BURST = 4
+TRENDS_POOL_SIZE = 4
+_shared = {}
+_shared_lock = threading.Lock()
+
+def shared_limiter() -> TokenBucket:
+  with _shared_lock:
+    if 'limiter' not in _shared:
+      _shared['limiter'] = TokenBucket(TRENDS_RATE, TRENDS_BURST)
+    return _shared['limiter']
+
+def shared_pool() -> SpyPool:
+  '''
+    Created on first use, so importing the collector doesn't open any clients.
+  '''
+  with _shared_lock:
+    if 'pool' not in _shared:
+      _shared['pool'] = SpyPool(TRENDS_POOL_SIZE)
+    return _shared['pool']
+
+def trends_scheduler(workers: int) -> RetryScheduler:
+  return RetryScheduler(
+    TRENDS_RETRY_POLICIES,
+    default=RetryPolicy(max_attempts=5, base=10, max_delay=300),
+    workers=workers
+  )
+
+def collect_rs_once(rk: str, sess: Session, spy: Spy):
+  related_queries = spy.query_related_search(rk, sess=sess).get('rising').to_records(index=False)
+  RS.bulk_upsert([rs[0] for rs in related_queries], None, sess.uuid, rk=rk)
+
+def collect_multiline_once(rs: RS, sess: Session, spy: Spy):
+  multiline, ref = spy.query_multiline(rs.rs, sess=sess)
+  multiline = multiline.drop(columns=['isPartial'])
+  Multiline.create_from_df(multiline, rskw=rs.rs, rs_uuid=rs.uuid, ref=ref)
+
+class MissingKeywordsError(KeyError):
+  '''
+    Some keywords of a batch were missing from the Trends frame. The rows of
+    the other keywords are already written; only `missing` should be retried.
+  '''
+
+  def __init__(self, written: list[RS], missing: list[RS]):
+    super().__init__(', '.join(dict.fromkeys(rs.rs for rs in missing)))
+    self.written = written
+    self.missing = missing
+
+def collect_multiline_batch_once(rss: list[RS], sess: Session, spy: Spy) -> tuple[list[RS], list[RS]]:
+  '''
+    One interest_over_time call for all distinct keywords of rss,
+    split back into one Multiline row per rs.
+    Returns (written, missing) rss.
+  '''
+  if len(rss) == 1:
+    collect_multiline_once(rss[0], sess, spy)
+    return rss, []
+  keywords = list(dict.fromkeys(rs.rs for rs in rss))
+  multiline, ref = spy.query_multiline_batch(keywords, sess=sess)
+  multiline = multiline.drop(columns=['isPartial'])
+  _, skipped = Multiline.create_many_from_df(multiline, [(rs.rs, rs.uuid) for rs in rss], ref=ref)
+  skipped = {rs_uuid for _, rs_uuid in skipped}
+  return [rs for rs in rss if rs.uuid not in skipped], [rs for rs in rss if rs.uuid in skipped]
+
+def batch_rss(rss: list[RS], batch_size: int) -> list[list[RS]]:
+  '''
+    Group rss into batches of at most batch_size distinct keywords;
+    rss sharing a keyword always land in the same batch.
+  '''
+  groups = {}
+  for rs in rss:
+    groups.setdefault(rs.rs, []).append(rs)
+  keywords = list(groups)
+  return [
+    [rs for keyword in keywords[i:i + batch_size] for rs in groups[keyword]]
+    for i in range(0, len(keywords), batch_size)
+  ]
+
+def _collect_multiline(rss: list[RS], sess: Session, pool: SpyPool, limiter: TokenBucket) -> int:
+  limiter.acquire()
+  with pool.client() as spy:
+    written, missing = collect_multiline_batch_once(rss, sess, spy)
+  if missing:
+    raise MissingKeywordsError(written, missing)
+  return len(written)
+
+def _collect_rs(rk: str, sess: Session, pool: SpyPool, limiter: TokenBucket):
+  limiter.acquire()
+  with pool.client() as spy:
+    collect_rs_once(rk, sess, spy)
+
+def pending_rss(rss: list[RS], checkpoint: Checkpoint, chunk_size: int = 500) -> list[RS]:
+  '''
+    Drop rss that already have a multiline or were given up on. Finished rows
+    are looked up with one Multiline query per chunk, and recorded as done
+    so the checkpoint also covers rows written before a crash.
+  '''
+  pending = []
+  for i in range(0, len(rss), chunk_size):
+    chunk = rss[i:i + chunk_size]
+    existing = Multiline.existing_rs_uuids([rs.uuid for rs in chunk])
+    checkpoint.mark('rs', [
+      rs.uuid for rs in chunk
+      if rs.uuid in existing and checkpoint.state('rs', rs.uuid) != State.DONE
+    ], State.DONE)
+    pending.extend(
+      rs for rs in chunk
+      if rs.uuid not in existing and checkpoint.state('rs', rs.uuid) != State.GIVEN_UP
+    )
+  return pending
+
+def collect_related(
+  rks: list[str],
+  sess: Session,
+  workers: int = 1,
+  limiter: TokenBucket = None,
+  pool: SpyPool = None,
+  checkpoint: Checkpoint = None
+) -> int:
+  '''
+    Collect the rising related searches of every root keyword into RS.
+    Failed keywords are retried later through the retry scheduler.
+    Upstream calls go through the process-wide limiter and client pool
+    unless others are passed in. Returns the number of root keywords finished.
+  '''
+  if checkpoint:
+    rks = [rk for rk in rks if not checkpoint.is_finished('rk', rk)]
+  mark = checkpoint.mark if checkpoint else lambda *args, **kwargs: None
+  sess = Session(uuid=sess.uuid, geo=sess.geo, timeframe=sess.timeframe)
+  limiter = limiter or shared_limiter()
+  pool = pool or shared_pool()
+  scheduler = trends_scheduler(workers)
+  progress = tqdm(total=len(rks), desc='Collecting RS')
+  finished = 0
+
+  def on_done(rk, result):
+    nonlocal finished
+    finished += 1
+    mark('rk', rk, State.DONE)
+    progress.update()
+
+  def on_retry(rk, error, attempt, delay):
+    logger.warning(f'Failed to collect rs for {rk}: {error}, retry {attempt} in {delay:.0f}s')
+    mark('rk', rk, State.FAILED, error=str(error))
+
+  def on_give_up(rk, error):
+    nonlocal finished
+    if isinstance(error, IndexError):
+      # 没有rising数据，不算失败
+      finished += 1
+      mark('rk', rk, State.DONE)
+    else:
+      logger.warning(f'Give up collecting rs for {rk}: {error}')
+      mark('rk', rk, State.GIVEN_UP, error=str(error))
+    progress.update()
+
+  stats = scheduler.run(
+    rks,
+    lambda rk: _collect_rs(rk, sess, pool, limiter),
+    on_done=on_done,
+    on_retry=on_retry,
+    on_give_up=on_give_up
+  )
+  progress.close()
+  logger.info(f'Collected rs for {finished}/{len(rks)} root keywords: {stats}')
+  return finished
+
+def collect_multilines(
+  rss: list[RS],
+  sess: Session,
+  workers: int = 4,
+  limiter: TokenBucket = None,
+  pool: SpyPool = None,
+  batch_size: int = MAX_BATCH_KEYWORDS,
+  checkpoint: Checkpoint = None
+):
+  '''
+    Collect multilines for all rss with `workers` threads. Every upstream call
+    takes a token from one bucket shared by the whole process (TRENDS_RATE
+    calls per second), and each worker borrows a Trends client from the
+    shared pool with rotated proxies, so throughput is bounded by the rate
+    cap rather than per-call latency.
+    Each call packs up to `batch_size` keywords next to the shared reference.
+    Failed batches wait in the retry scheduler's delayed queue instead of
+    holding a worker. With a checkpoint, rows finished by an earlier run are
+    skipped and the state of every row is recorded as it completes.
+  '''
+  total = len(rss)
+  if checkpoint:
+    rss = pending_rss(rss, checkpoint)
+    logger.info(f'Resuming multiline collection: {total - len(rss)}/{total} rs already finished')
+  mark = checkpoint.mark if checkpoint else lambda *args, **kwargs: None
+  # ORM实例不能跨线程共享，交给worker的是只带必要字段的临时对象
+  sess = Session(uuid=sess.uuid, geo=sess.geo, timeframe=sess.timeframe)
+  rss = [RS(uuid=rs.uuid, rs=rs.rs, rk=rs.rk, session_uuid=rs.session_uuid) for rs in rss]
+  batches = batch_rss(rss, min(batch_size, MAX_BATCH_KEYWORDS))
+  limiter = limiter or shared_limiter()
+  pool = pool or shared_pool()
+  scheduler = trends_scheduler(workers)
+  progress = tqdm(total=len(batches), desc='Collecting Multiline')
+  done = 0
+
+  def label(batch):
+    return ', '.join(dict.fromkeys(rs.rs for rs in batch))
+
+  def on_done(batch, count):
+    nonlocal done
+    done += count
+    mark('rs', [rs.uuid for rs in batch], State.DONE)
+    progress.update()
+
+  def settle_partial(batch, error):
+    # 批次里已经写入的行算完成，之后只重试缺失的关键词
+    nonlocal done
+    if isinstance(error, MissingKeywordsError):
+      done += len(error.written)
+      mark('rs', [rs.uuid for rs in error.written], State.DONE)
+      batch[:] = error.missing
+
+  def on_retry(batch, error, attempt, delay):
+    settle_partial(batch, error)
+    logger.warning(f'Failed to collect multiline for {label(batch)}: {error}, retry {attempt} in {delay:.0f}s')
+    mark('rs', [rs.uuid for rs in batch], State.FAILED, error=str(error))
+
+  def on_give_up(batch, error):
+    settle_partial(batch, error)
+    logger.warning(f'Give up collecting multiline for {label(batch)}: {error}')
+    mark('rs', [rs.uuid for rs in batch], State.GIVEN_UP, error=str(error))
+    progress.update()
+
+  stats = scheduler.run(
+    batches,
+    lambda batch: _collect_multiline(batch, sess, pool, limiter),
+    on_done=on_done,
+    on_retry=on_retry,
+    on_give_up=on_give_up
+  )
+  progress.close()
+  logger.info(f'Collected multiline for {done}/{len(rss)} rs in {len(batches)} batches: {stats}')
+  return done
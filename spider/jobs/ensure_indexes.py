@@ -0,0 +1,24 @@
+import sys
+import os
+
+# 添加父目录到sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from webapp.model.rs import RS
+from webapp.model.multiline import Multiline
+from spider.common.logger import logger
+
+def ensure_indexes():
+  '''
+    Create the indexes the /session/<uuid>/top endpoint relies on.
+    Existing indexes are skipped, so it is safe to run on every deploy.
+  '''
+  for model in (RS, Multiline):
+    model.ensure_indexes()
+    logger.info(f'Indexes of {model.__tablename__} are in place')
+
+if __name__ == '__main__':
+  ensure_indexes()
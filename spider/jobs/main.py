@@ -7,73 +7,50 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from dotenv import load_dotenv
 load_dotenv()
 
-import traceback, time
+import argparse
 
-from tqdm import tqdm
-
-from datasource.spy import Spy
 from webapp.model.session import Session
 from webapp.model.rs import RS
-from webapp.model.multiline import Multiline
+from webapp.model.series import SessionSeries
+from jobs.checkpoint import Checkpoint
+from jobs.collector import collect_related, collect_multilines
+from spider.common.cache import Cache
 from spider.common.const import RootKeywords
 from spider.common.logger import logger
 
-def collect_rs(rk: str, sess: Session):
-  for i in range(5):
-    try:
-      spy = Spy(0)
-      related_queries = spy.query_related_search(rk, sess=sess).get('rising').to_records(index=False)
-      for rs in related_queries:
-        if RS.validate(rs[0]) and not RS.exists(rs[0], sess.uuid):
-          rs = RS.create(
-            rs=rs[0],
-            rk=rk,
-            session_uuid=sess.uuid
-          )
-          RS.conn.session.add(rs)
-      RS.conn.session.commit()
-      break
-    except IndexError as e:
-      break
-    except Exception as e:
-      logger.warning(f'Failed to collect rs for {rk}: {e}, retrying for {i} times')
-      traceback.print_exc()
-      j = i 
-      if i > 1:
-        j=2
-      time.sleep(60 * (j) + 10)
+def collect_rs(rk: str, sess: Session) -> bool:
+  '''
+    Returns False when the keyword was given up after retries.
+  '''
+  return collect_related([rk], sess) == 1
 
 def collect_multiline(rs: RS, sess: Session):
-  for i in range(5):
-    try:
-      spy = Spy(0)
-      multiline, ref = spy.query_multiline(rs.rs, sess=sess)
-      multiline.drop(['isPartial'], axis=1, inplace=True)
-      Multiline.create_from_df(multiline, rskw=rs.rs, rs_uuid=rs.uuid, ref=ref)
-      break
-    except AttributeError as e:
-      logger.warning(f'raw data is invalid for {rs.rs}: {e}, exit')
-      break
-    except Exception as e:
-      logger.warning(f'Failed to collect multiline for {rs.rs}: {e}, retrying for {i} times')
-      traceback.print_exc()
-      j = i 
-      if i > 1:
-        j=2
-      time.sleep(60 * (j) + 10)
-
-def main(geo: str, timeframe: str):
-  sess = Session.create(
-    geo=geo,
-    timeframe=timeframe
-  )
-  for rk in tqdm(RootKeywords, total=len(RootKeywords), desc='Collecting RS'):
-    collect_rs(rk, sess=sess) 
+  collect_multilines([rs], sess, workers=1)
+
+def main(geo: str, timeframe: str, resume: str = None):
+  if resume:
+    sess = Session.find_one_by(uuid=resume)
+    if sess is None:
+      raise ValueError(f'session {resume} not found')
+    logger.info(f'Resuming session {sess.uuid}')
+  else:
+    sess = Session.create(
+      geo=geo,
+      timeframe=timeframe
+    )
+  checkpoint = Checkpoint(sess.uuid)
+  collect_related(RootKeywords, sess=sess, checkpoint=checkpoint)
 
   rss = RS.conn.session.query(RS).filter(RS.session_uuid==sess.uuid).all()
 
-  for rs in tqdm(rss, total=len(rss), desc='Collecting Multiline'):
-    collect_multiline(rs, sess=sess)
+  collect_multilines(rss, sess=sess, checkpoint=checkpoint)
+  SessionSeries.query(sess.uuid).save()
+  logger.info(f'Checkpoint {checkpoint.path}: rk {checkpoint.summary("rk")}, rs {checkpoint.summary("rs")}')
+  logger.info(f'数据库连接统计: {RS.conn.stats}')
+  logger.info(f'缓存统计: {Cache.stats()}')
 
 if __name__ == '__main__':
-  main('', 'now 7-d')
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--resume', metavar='SESSION_UUID', help='continue an interrupted session')
+  args = parser.parse_args()
+  main('', 'now 7-d', resume=args.resume)
@@ -0,0 +1,59 @@
+import sys
+import os
+
+# 添加父目录到sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+
+import numpy as np
+
+from webapp.model.rs import RS
+from webapp.model.multiline import Multiline, batch_geometric_trend_score
+from webapp.model.series import SessionSeries
+from spider.common.logger import logger
+
+def iter_session_metrics(session_uuid: str, chunk_size: int):
+  '''
+    Yield [(id, metric), ...] chunks of the session's multilines.
+  '''
+  query = Multiline.conn.session.query(Multiline.id, Multiline.metric).join(
+    RS, RS.uuid == Multiline.rs_uuid
+  ).filter(RS.session_uuid == session_uuid)
+  return Multiline.iter_all(batch_size=chunk_size, query=query)
+
+def score_rows(rows, stability_weight: float) -> dict[int, float]:
+  '''
+    Score a chunk in one vectorized pass per series length
+    (a session normally has a single length).
+  '''
+  by_length = {}
+  for row in rows:
+    by_length.setdefault(len(row.metric), []).append(row)
+  scores = {}
+  for group in by_length.values():
+    matrix = np.array([row.metric for row in group], dtype=float).reshape(len(group), -1)
+    for row, score in zip(group, batch_geometric_trend_score(matrix, stability_weight)):
+      scores[row.id] = float(score)
+  return scores
+
+def rescore_session(session_uuid: str, stability_weight: float = 0.4, chunk_size: int = 1000) -> int:
+  total = 0
+  for rows in iter_session_metrics(session_uuid, chunk_size):
+    Multiline.bulk_update_scores(score_rows(rows, stability_weight))
+    total += len(rows)
+  if os.path.exists(SessionSeries.path(session_uuid)):
+    SessionSeries.query(session_uuid).save()
+  logger.info(f'Rescored {total} multilines of session {session_uuid} with stability_weight={stability_weight}')
+  return total
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('session_uuid')
+  parser.add_argument('--stability-weight', type=float, default=0.4)
+  parser.add_argument('--chunk-size', type=int, default=1000)
+  args = parser.parse_args()
+  rescore_session(args.session_uuid, args.stability_weight, args.chunk_size)
@@ -3,7 +3,9 @@ from datetime import datetime, date
 from typing import TypeVar
 import pandas as pd
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, DateTime, update, desc
+from sqlalchemy import Column, DateTime, update, desc, tuple_
+from sqlalchemy.orm import ColumnProperty
+from sqlalchemy.orm.attributes import InstrumentedAttribute
 
 from spider.common.logger import logger
 from .db_conn import SQLAlchemyConnection
@@ -71,22 +73,62 @@ class BaseModel(Base):
       **kwargs
     )
   
+  @classmethod
+  def iter_all(
+    cls,
+    batch_size: int = 500,
+    order_by = None,
+    query = None,
+    **kwargs
+  ):
+    '''
+      Yield the matching rows in batches of at most batch_size, paging with
+      WHERE (order_by, id) > (last, last_id) instead of OFFSET, so every page
+      costs the same and only one batch is held in memory.
+      order_by must be a plain mapped column, sorted ascending (the primary key
+      by default); the primary key is added as a tiebreaker so rows sharing an
+      order_by value are never skipped at a page boundary. `query` may narrow
+      or reshape the rows, as long as it selects order_by and the primary key.
+    '''
+    primary_key = cls.__mapper__.primary_key[0]
+    pk = getattr(cls, primary_key.key)
+    if order_by is None:
+      order_by = pk
+    if not (isinstance(order_by, InstrumentedAttribute) and isinstance(order_by.property, ColumnProperty)):
+      raise ValueError(f'iter_all pages on a plain ascending column, got {order_by!r}')
+    if query is None:
+      query = cls.conn.session.query(cls)
+    kwargs = [getattr(cls, k) == v for k, v in kwargs.items()]
+    keys = [order_by] if order_by is pk else [order_by, pk]
+    query = query.filter(*kwargs).order_by(*keys)
+    last = None
+    while True:
+      page = query if last is None else query.filter(tuple_(*keys) > tuple_(*last))
+      batch = page.limit(batch_size).all()
+      if not batch:
+        return
+      yield batch
+      if len(batch) < batch_size:
+        return
+      last = [getattr(batch[-1], key.key) for key in keys]
+
   @classmethod
   def find_all(
     cls,
     order_by: dict = None,
     **kwargs
   ):
-    result = []
-    page = 1
-    while True:
-      batch_result = cls.find_by_page(page=page, limit=50, order_by=order_by, **kwargs)
-      if not batch_result:
-        break
-      result.extend(batch_result)
-      page += 1
-    return result
-  
+    return [row for batch in cls.iter_all(order_by=order_by, **kwargs) for row in batch]
+
+  @classmethod
+  def ensure_indexes(cls):
+    '''
+      Create the indexes declared in __table_args__ that don't exist yet.
+    '''
+    bind = cls.conn.session.get_bind()
+    for index in cls.__table__.indexes:
+      index.create(bind=bind, checkfirst=True)
+
   @classmethod
   def get_all_count_by(cls, **kwargs):
     kwargs = [getattr(cls, k) == v for k, v in kwargs.items()]
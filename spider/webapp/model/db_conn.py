@@ -1,3 +1,6 @@
+import threading
+from contextlib import contextmanager
+
 from sqlalchemy import create_engine, Engine, text
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.exc import OperationalError, DisconnectionError, SQLAlchemyError
@@ -22,6 +25,10 @@ class SQLAlchemyConnection:
     def __init__(self):
         if SQLAlchemyConnection._instance is not None:
             raise Exception("This is a singleton class. Use get_instance() method.")
+        # probes_saved: 访问session时复用已经checkout的连接的次数，旧实现每次都会执行SELECT 1，
+        # 新的checkout仍由pool_pre_ping检查，不计入
+        self.stats = {'probes_saved': 0, 'liveness_checks': 0, 'reconnects': 0}
+        self._stats_lock = threading.Lock()
         self._conn()
         SQLAlchemyConnection._instance = self
 
@@ -29,24 +36,69 @@ class SQLAlchemyConnection:
         self.__engine = self.__connect(config.mysql_uri)
         self.__session_maker = scoped_session(sessionmaker(bind=self.__engine))
 
+    def _count(self, key: str):
+        # 多个线程共用同一个连接对象，计数需要加锁
+        with self._stats_lock:
+            self.stats[key] += 1
+
     def _get_session(self):
         session = self.__session_maker()
+        if not session.is_active:
+            # 上一次操作失败后留下了需要回滚的事务
+            session.rollback()
+        reused = session.in_transaction()
         session.connection()
+        if reused:
+            self._count('probes_saved')
         return session
 
     @property
     def session(self):
-        session = self._get_session()
+        """
+        获取当前线程的session
+
+        不再每次访问都执行SELECT 1：连接的可用性由pool_pre_ping在checkout时检查，
+        只有在出错之后才会检查并重连
+        """
+        try:
+            session = self._get_session()
+        except (OperationalError, DisconnectionError) as e:
+            self._recover(e)
+            return self._get_session()
+        return session
+
+    @contextmanager
+    def session_scope(self):
+        """
+        一个工作单元：正常结束时提交，出错时回滚；
+        如果是连接错误，回滚后检查连接并在需要时重连，再把异常抛给调用者
+        """
+        session = self.session
+        try:
+            yield session
+            session.commit()
+        except (OperationalError, DisconnectionError) as e:
+            session.rollback()
+            self._recover(e)
+            raise
+        except Exception:
+            session.rollback()
+            raise
+
+    def _recover(self, error):
+        """出错后检查连接是否可用，不可用时重新连接数据库"""
+        self.__logger.error(f"数据库连接失败: {error}")
+        self._count('liveness_checks')
+        session = self.__session_maker()
         try:
-            session.execute(text("SELECT 1"))
-            return session
-        except (OperationalError, DisconnectionError, SQLAlchemyError) as e:
-            self.__logger.error(f"数据库连接失败: {e}")
             session.rollback()
+            session.execute(text("SELECT 1"))
+        except (OperationalError, DisconnectionError, SQLAlchemyError):
             session.close()
+            self.__session_maker.remove()
             # 重新连接数据库
             self._conn()
-            return self._get_session()
+            self._count('reconnects')
     
     def __connect(self, database_url):
         """
@@ -1,10 +1,11 @@
 from datetime import datetime, timezone
 
-from sqlalchemy import Column, DateTime, String, BIGINT, JSON, Float
+from sqlalchemy import Column, DateTime, String, BIGINT, JSON, Float, Index, tuple_
 from pandas import DataFrame
 import numpy as np
 
 from .base import BaseModel
+from .rs import RS
 
 def calculate_geometric_trend_score(data, stability_weight=0.4):
     """
@@ -56,8 +57,58 @@ def calculate_geometric_trend_score(data, stability_weight=0.4):
     
     return max(0.0, min(1.0, final_score))
 
+def batch_geometric_trend_score(matrix, stability_weight=0.4):
+    """
+    calculate_geometric_trend_score的向量化版本，一次计算多条序列
+    
+    Parameters:
+    matrix: 形状为 (序列数, 点数) 的二维数组，每行是一条等长的时间序列
+    stability_weight: 稳定性权重
+    
+    Returns:
+    np.ndarray: 每条序列0-1之间的分数
+    """
+    series = np.asarray(matrix, dtype=float)
+    if series.ndim != 2:
+        raise ValueError(f'matrix must be 2-D, got shape {series.shape}')
+    n_rows, n_points = series.shape
+    if n_points < 4:
+        return np.zeros(n_rows)
+    rows = np.arange(n_rows)
+    
+    # 1. 连续性
+    diffs = np.diff(series, axis=1)
+    value_range = series.max(axis=1) - series.min(axis=1) + 1e-6
+    continuity_score = 1.0 - diffs.std(axis=1) / value_range
+    
+    # 2. 持续增长
+    growth_score = (diffs > 0).sum(axis=1) / diffs.shape[1]
+    
+    # 3. 单点尖峰
+    peak_idx = series.argmax(axis=1)
+    peak = series[rows, peak_idx]
+    inner = (peak_idx > 0) & (peak_idx < n_points - 1)
+    before = series[rows, np.clip(peak_idx - 1, 0, n_points - 1)]
+    after = series[rows, np.clip(peak_idx + 1, 0, n_points - 1)]
+    is_spike = inner & (before < 0.3 * peak) & (after < 0.3 * peak)
+    shape_penalty = np.where(is_spike, 0.2, 1.0)
+    
+    # 4. 趋势强度
+    trend_score = np.maximum(0, (series[:, -1] - series[:, 0]) / 100.0) * shape_penalty
+    
+    stability_score = (continuity_score + growth_score) / 2
+    final_score = (
+        stability_weight * stability_score +
+        (1 - stability_weight) * trend_score
+    )
+    return np.clip(final_score, 0.0, 1.0)
+
 class Multiline(BaseModel):
   __tablename__ = 'multiline'
+  __table_args__ = (
+    # 按session取排名时，由rs.session_uuid连接过来后按score排序
+    Index('ix_multiline_rs_uuid_score', 'rs_uuid', 'score'),
+  )
 
   id = Column(BIGINT, nullable=False, primary_key=True)
   rs_uuid = Column(String, nullable=False)
@@ -70,6 +121,40 @@ class Multiline(BaseModel):
   def exists(cls, rs_uuid: str):
     return cls.conn.session.query(cls).filter(cls.rs_uuid == rs_uuid).first() is not None
   
+  @classmethod
+  def top_by_session(cls, session_uuid: str, n: int = 20, after: int = None) -> list:
+    '''
+      The session's multilines ordered by (score, id) descending, n at a time.
+      Pass the id of the last row as `after` for the next page; its score is
+      read back on the server, so the keyset filter compares against the
+      stored value instead of a float that went through the client.
+    '''
+    query = cls.conn.session.query(
+      cls.id, cls.rs_uuid, RS.rs, RS.rk, cls.score
+    ).join(
+      RS, RS.uuid == cls.rs_uuid
+    ).filter(
+      RS.session_uuid == session_uuid
+    )
+    if after is not None:
+      after_score = cls.conn.session.query(cls.score).filter(cls.id == after).scalar_subquery()
+      query = query.filter(tuple_(cls.score, cls.id) < tuple_(after_score, after))
+    return query.order_by(cls.score.desc(), cls.id.desc()).limit(n).all()
+
+  @classmethod
+  def existing_rs_uuids(cls, rs_uuids: list[str], chunk_size: int = 500) -> set[str]:
+    '''
+      The subset of rs_uuids that already have a multiline,
+      with one IN query per chunk instead of Multiline.exists per row.
+    '''
+    existing = set()
+    for i in range(0, len(rs_uuids), chunk_size):
+      rows = cls.conn.session.query(cls.rs_uuid).filter(
+        cls.rs_uuid.in_(rs_uuids[i:i + chunk_size])
+      ).distinct().all()
+      existing.update(row.rs_uuid for row in rows)
+    return existing
+
   @classmethod
   def create_from_df(cls, df: DataFrame, rskw: str, rs_uuid: str, ref: str):
     data = df.to_dict()
@@ -82,5 +167,56 @@ class Multiline(BaseModel):
       score=calculate_geometric_trend_score(metric),
       created_at=datetime.now(timezone.utc)
     )
-    cls.conn.session.add(instance)
-    cls.conn.session.commit()
+    with cls.conn.session_scope() as session:
+      session.add(instance)
+
+  @classmethod
+  def create_many_from_df(cls, df: DataFrame, rs_pairs: list[tuple[str, str]], ref: str):
+    '''
+      Split a batched interest_over_time frame (several keywords plus one shared
+      reference column) into one row per (rskw, rs_uuid) and save them together.
+      Each keyword is rescaled with the reference so that max(keyword, reference)
+      is 100, i.e. what a single [keyword, reference] query would return.
+      Returns the number of rows written and the pairs whose keyword is
+      missing from the frame, so the caller can retry them.
+    '''
+    benchmark = df[ref].to_numpy(dtype=float)
+    now = datetime.now(timezone.utc)
+    pairs, metrics, benchmarks, skipped = [], [], [], []
+    for rskw, rs_uuid in rs_pairs:
+      if rskw not in df.columns:
+        cls.logger.warning(f'{rskw} is missing in the batched result, skip')
+        skipped.append((rskw, rs_uuid))
+        continue
+      metric = df[rskw].to_numpy(dtype=float)
+      peak = max(metric.max(), benchmark.max())
+      factor = 100.0 / peak if peak > 0 else 1.0
+      pairs.append((rskw, rs_uuid))
+      metrics.append(np.round(metric * factor, 2))
+      benchmarks.append(np.round(benchmark * factor, 2))
+    if not pairs:
+      return 0, skipped
+    scores = batch_geometric_trend_score(np.array(metrics).reshape(len(metrics), len(df)))
+    instances = [
+      cls(
+        rs_uuid=rs_uuid,
+        metric=metric.tolist(),
+        benchmark=benchmark.tolist(),
+        score=float(score),
+        created_at=now
+      )
+      for (_, rs_uuid), metric, benchmark, score in zip(pairs, metrics, benchmarks, scores)
+    ]
+    with cls.conn.session_scope() as session:
+      session.add_all(instances)
+    return len(instances), skipped
+
+  @classmethod
+  def bulk_update_scores(cls, scores: dict[int, float]):
+    '''
+      Write {id: score} back in one executemany UPDATE.
+    '''
+    if not scores:
+      return
+    with cls.conn.session_scope() as session:
+      session.bulk_update_mappings(cls, [{'id': id, 'score': score} for id, score in scores.items()])
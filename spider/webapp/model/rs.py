@@ -1,13 +1,16 @@
 from uuid import uuid4
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 
-from sqlalchemy import Column, DateTime, String
+from sqlalchemy import Column, DateTime, String, Index, insert
 from sqlalchemy.sql.expression import func
 
 from .base import BaseModel
 
 class RS(BaseModel):
   __tablename__ = 'rs'
+  __table_args__ = (
+    Index('ix_rs_session_uuid', 'session_uuid'),
+  )
 
   uuid = Column(String, nullable=False, primary_key=True)
   rs = Column(String, nullable=False)
@@ -30,6 +33,57 @@ class RS(BaseModel):
       cls.session_uuid == session_uuid,
     ).first() is not None
 
+  @classmethod
+  def bulk_upsert(
+    cls,
+    words: list[str],
+    rk_prefix: str | None,
+    session_uuid: str,
+    rk: str | None = None,
+    chunk_size: int = 500
+  ) -> list[str]:
+    '''
+      Insert the valid words that are not yet in the session, replacing one
+      RS.exists round-trip per word with one IN query and one multi-row
+      INSERT per chunk. rk defaults to "{rk_prefix}-{word}" (or the word
+      itself without a prefix); pass rk to use the same root keyword for all.
+      Returns the inserted words.
+    '''
+    candidates = {}
+    for word in words:
+      if not word or not cls.validate(word):
+        continue
+      # MySQL默认排序规则不区分大小写，与RS.exists的判断保持一致
+      candidates.setdefault(word.lower(), word)
+    if not candidates:
+      return []
+
+    keys = list(candidates)
+    existing = set()
+    with cls.conn.session_scope() as session:
+      for i in range(0, len(keys), chunk_size):
+        chunk = [candidates[key] for key in keys[i:i + chunk_size]]
+        rows = session.query(cls.rs).filter(
+          cls.session_uuid == session_uuid,
+          cls.rs.in_(chunk),
+        ).all()
+        existing.update(row.rs.lower() for row in rows)
+
+      new_words = [word for key, word in candidates.items() if key not in existing]
+      now = datetime.now(timezone.utc)
+      for i in range(0, len(new_words), chunk_size):
+        session.execute(insert(cls).values([
+          {
+            'uuid': str(uuid4()),
+            'rs': word,
+            'rk': rk or (f'{rk_prefix}-{word}' if rk_prefix else word),
+            'session_uuid': session_uuid,
+            'created_at': now,
+          }
+          for word in new_words[i:i + chunk_size]
+        ]))
+    return new_words
+
   @classmethod
   def create(cls, rs: str, rk: str, session_uuid: str):
     instance = cls(
@@ -0,0 +1,120 @@
+import os
+from collections import Counter
+
+import numpy as np
+from pandas import DataFrame
+
+from spider.common.logger import logger
+from .multiline import Multiline, batch_geometric_trend_score
+from .rs import RS
+
+class SessionSeries:
+  '''
+    Column-oriented copy of all multilines of a session: metric and benchmark
+    as float32 (n_keywords, n_points) matrices, with id / rs_uuid / keyword /
+    score arrays aligned to the rows. Built from one joined query and kept as
+    .series/<session_uuid>.npz, so analysis doesn't go through the ORM and JSON.
+  '''
+
+  DIR = '.series'
+
+  def __init__(
+    self,
+    session_uuid: str,
+    ids: np.ndarray,
+    rs_uuids: np.ndarray,
+    keywords: np.ndarray,
+    scores: np.ndarray,
+    metric: np.ndarray,
+    benchmark: np.ndarray
+  ):
+    self.session_uuid = session_uuid
+    self.ids = ids
+    self.rs_uuids = rs_uuids
+    self.keywords = keywords
+    self.scores = scores
+    self.metric = metric
+    self.benchmark = benchmark
+
+  def __len__(self):
+    return len(self.ids)
+
+  @classmethod
+  def path(cls, session_uuid: str) -> str:
+    return os.path.join(cls.DIR, f'{session_uuid}.npz')
+
+  @classmethod
+  def query(cls, session_uuid: str) -> 'SessionSeries':
+    rows = Multiline.conn.session.query(
+      Multiline.id, Multiline.rs_uuid, RS.rs, Multiline.score, Multiline.metric, Multiline.benchmark
+    ).join(
+      RS, RS.uuid == Multiline.rs_uuid
+    ).filter(
+      RS.session_uuid == session_uuid
+    ).order_by(Multiline.id).all()
+    if rows:
+      # 同一个session的序列应该等长，个别长度不一致的行丢弃
+      n_points = Counter(len(row.metric) for row in rows).most_common(1)[0][0]
+      skipped = [row.id for row in rows if len(row.metric) != n_points or len(row.benchmark) != n_points]
+      if skipped:
+        logger.warning(f'Skip {len(skipped)} multilines of session {session_uuid} with length != {n_points}: {skipped[:10]}')
+        rows = [row for row in rows if len(row.metric) == n_points and len(row.benchmark) == n_points]
+    else:
+      n_points = 0
+    return cls(
+      session_uuid,
+      ids=np.array([row.id for row in rows], dtype=np.int64),
+      rs_uuids=np.array([row.rs_uuid for row in rows], dtype=str),
+      keywords=np.array([row.rs for row in rows], dtype=str),
+      scores=np.array([row.score for row in rows], dtype=np.float32),
+      metric=np.array([row.metric for row in rows], dtype=np.float32).reshape(len(rows), n_points),
+      benchmark=np.array([row.benchmark for row in rows], dtype=np.float32).reshape(len(rows), n_points)
+    )
+
+  def save(self) -> str:
+    path = self.path(self.session_uuid)
+    os.makedirs(self.DIR, exist_ok=True)
+    tmp = f'{path}.tmp.npz'
+    np.savez(
+      tmp,
+      ids=self.ids,
+      rs_uuids=self.rs_uuids,
+      keywords=self.keywords,
+      scores=self.scores,
+      metric=self.metric,
+      benchmark=self.benchmark
+    )
+    os.replace(tmp, path)
+    return path
+
+  @classmethod
+  def load(cls, session_uuid: str, refresh: bool = False) -> 'SessionSeries':
+    '''
+      Read the session's export, building it first when missing or refresh is set.
+    '''
+    path = cls.path(session_uuid)
+    if refresh or not os.path.exists(path):
+      series = cls.query(session_uuid)
+      series.save()
+      return series
+    with np.load(path) as data:
+      return cls(session_uuid, **{key: data[key] for key in data.files})
+
+  def score(self, stability_weight: float = 0.4) -> np.ndarray:
+    return batch_geometric_trend_score(self.metric, stability_weight)
+
+  def top(self, n: int = 10, scores: np.ndarray = None) -> list[tuple[str, float]]:
+    scores = self.scores if scores is None else scores
+    order = np.argsort(-scores, kind='stable')[:n]
+    return [(str(self.keywords[i]), float(scores[i])) for i in order]
+
+  def to_frame(self) -> DataFrame:
+    '''
+      One row per keyword, one column per point of the metric series.
+    '''
+    frame = DataFrame(self.metric, columns=[f'p{i}' for i in range(self.metric.shape[1])])
+    frame.insert(0, 'score', self.scores)
+    frame.insert(0, 'keyword', self.keywords)
+    frame.insert(0, 'rs_uuid', self.rs_uuids)
+    frame.insert(0, 'id', self.ids)
+    return frame
@@ -21,6 +21,6 @@ class Session(BaseModel):
       timeframe=timeframe,
       created_at=datetime.now(timezone.utc)
     )
-    cls.conn.session.add(instance)
-    cls.conn.session.commit()
+    with cls.conn.session_scope() as session:
+      session.add(instance)
     return instance
\ No newline at end of file
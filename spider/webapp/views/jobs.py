@@ -0,0 +1,20 @@
+from flask import Blueprint, jsonify
+
+from common.jobqueue import JobQueue
+from webapp.model.base import BaseModel
+
+jobs = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+# 采集接口的后台任务，请求线程只负责入队；
+# 每个job结束后释放worker线程的scoped session，连接归还连接池
+queue = JobQueue(workers=4, teardown=BaseModel.conn.close)
+
+def accepted(job_id: str):
+  return jsonify({'job_id': job_id, 'status': queue.get(job_id)['status']}), 202
+
+@jobs.route('/<job_id>', methods=['GET'])
+def get_job(job_id: str):
+  job = queue.get(job_id)
+  if job is None:
+    return jsonify({'errmsg': f'Job {job_id} not found'}), 404
+  return jsonify(job)
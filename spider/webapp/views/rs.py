@@ -1,32 +1,24 @@
-import traceback, time
-
 from flask import Blueprint, jsonify
 
-from datasource.spy import Spy
+from jobs.collector import collect_multilines
 from webapp.model.rs import RS
 from webapp.model.session import Session
 from webapp.model.multiline import Multiline
-from common.logger import logger
+from webapp.views.jobs import queue, accepted
 
 rs = Blueprint('rs', __name__, url_prefix='/rs')
 
+def collect_multiline_job(uuid: str):
+  rs = RS.find_one_by(uuid=uuid)
+  sess = Session.find_one_by(uuid=rs.session_uuid)
+  if not collect_multilines([rs], sess, workers=1):
+    raise RuntimeError(f'Failed to collect multiline for {rs.rs}')
+  return {'uuid': uuid}
+
 @rs.route('/<uuid>', methods=['POST'])
 def collect_rs(uuid: str):
   if Multiline.exists(uuid):
     return jsonify({'uuid': uuid})
-  rs = RS.conn.session.query(RS).filter(RS.uuid == uuid).first()
-  sess = Session.conn.session.query(Session).filter(Session.uuid == rs.session_uuid).first()
-  for i in range(5):
-    try:
-      spy = Spy(i)
-      multiline, ref = spy.query_multiline(rs.rs, sess=sess)
-      multiline.drop(['isPartial'], axis=1, inplace=True)
-      Multiline.create_from_df(multiline, rskw=rs.rs, rs_uuid=uuid, ref=ref)
-      return jsonify({'uuid': uuid})
-    except AttributeError as e:
-      logger.warning(f'raw data is invalid for {rs.rs}: {e}, exit')
-      break
-    except Exception as e:
-      logger.warning(f'Failed to collect multiline for {rs.rs}: {e}, retrying for {i} times')
-      traceback.print_exc()
-  return jsonify({'errmsg': f'Failed to collect multiline for {rs.rs}'}), 500
\ No newline at end of file
+  if RS.find_one_by(uuid=uuid) is None:
+    return jsonify({'errmsg': f'RS {uuid} not found'}), 404
+  return accepted(queue.submit(collect_multiline_job, uuid, key=f'multiline:{uuid}'))
@@ -1,38 +1,51 @@
-import traceback, time
-
 from flask import Blueprint, request, jsonify
 
+from jobs.collector import collect_related
 from webapp.model.session import Session
-from webapp.model.rs import RS
-from datasource.spy import Spy
-from common.logger import logger
+from webapp.model.multiline import Multiline
+from webapp.views.jobs import queue, accepted
 
 session = Blueprint('session', __name__, url_prefix='/session')
 
+MAX_TOP_N = 500
+
+def collect_rs_job(uuid: str, rk: str):
+  sess = Session.find_one_by(uuid=uuid)
+  if not collect_related([rk], sess):
+    raise RuntimeError(f'Failed to collect rs for {rk}')
+  return {'uuid': uuid}
+
 @session.route('/<uuid>/rs', methods=['POST'])
 def collect_rs_by_session_uuid(uuid):
   data = request.json
   rk = data.get('rk')
-  sess = Session.conn.session.query(Session).filter(Session.uuid == uuid).first()
-  for i in range(5):
-    try:
-      spy = Spy(i)
-      related_queries = spy.query_related_search(rk, sess=sess).get('rising').to_records(index=False)
-      for rs in related_queries:
-        if RS.validate(rs[0]) and not RS.exists(rs[0], uuid):
-          rs = RS.create(
-            rs=rs[0],
-            rk=rk,
-            session_uuid=uuid
-          )
-          RS.conn.session.add(rs)
-      RS.conn.session.commit()
-      return jsonify({'uuid': uuid})
-    except IndexError as e:
-      logger.warning(f'No related search for {rk}: {e}, exit')
-      break
-    except Exception as e:
-      logger.warning(f'Failed to collect rs for {rk}: {e}, retrying for {i} times')
-      traceback.print_exc()
-      time.sleep(60)
-  return jsonify({'errmsg': f'Failed to collect rs for {rk}'}), 500
\ No newline at end of file
+  if not rk:
+    return jsonify({'errmsg': 'rk is required'}), 400
+  if Session.find_one_by(uuid=uuid) is None:
+    return jsonify({'errmsg': f'Session {uuid} not found'}), 404
+  return accepted(queue.submit(collect_rs_job, uuid, rk, key=f'rs:{uuid}:{rk}'))
+
+@session.route('/<uuid>/top', methods=['GET'])
+def top_keywords(uuid):
+  '''
+    Best scored keywords of a session. Pass the returned next_cursor
+    as ?cursor= to get the following page.
+  '''
+  try:
+    n = min(int(request.args.get('n', 20)), MAX_TOP_N)
+    if n < 1:
+      raise ValueError(n)
+    cursor = request.args.get('cursor')
+    after = int(cursor) if cursor else None
+  except ValueError:
+    return jsonify({'errmsg': 'n must be a positive integer and cursor must come from next_cursor'}), 400
+  rows = Multiline.top_by_session(uuid, n=n, after=after)
+  next_cursor = str(rows[-1].id) if len(rows) == n else None
+  return jsonify({
+    'uuid': uuid,
+    'items': [
+      {'id': row.id, 'rs_uuid': row.rs_uuid, 'rs': row.rs, 'rk': row.rk, 'score': row.score}
+      for row in rows
+    ],
+    'next_cursor': next_cursor
+  })